@@ -5,5 +5,13 @@ Created on Sat Sep 20 18:38:30 2025
 @author: paula gomez sotres
 """
 
-from .core import take_all_files, run_background_subtraction_for_analysis, detect_immobility, calculate_immobility_by_bin_core, create_immobility_mark_video,create_csv_immobility
-from .gui import immobilityAnalyzerGUI
+from .core import take_all_files, run_background_subtraction_for_analysis, run_background_subtraction_batch, run_background_subtraction_segmented, run_background_subtraction_multi_roi, detect_immobility, detect_immobility_batch, calculate_immobility_by_bin_core, calculate_immobility_by_bins, create_immobility_mark_video, create_immobility_mark_videos, create_immobility_bout_clips, marked_video_path, benchmark_mark_video_settings, create_csv_immobility, immobility_bouts, bouts_to_mask, padded_bout_ranges, load_frame_store, find_frame_stores, ANALYSIS_DEFAULTS, analysis_params_from_config, run_cohort
+
+
+def __getattr__(name):
+    # The GUI pulls in tkinter and PIL; import it only when it is asked for, so
+    # `import still_count` stays as light as still_count.core (CLI, worker processes)
+    if name == "immobilityAnalyzerGUI":
+        from .gui import immobilityAnalyzerGUI
+        return immobilityAnalyzerGUI
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
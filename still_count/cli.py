@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch runner: the same take_all_files -> background subtraction -> detect_immobility ->
+binning -> CSV/Excel pipeline as the GUI, driven by a saved config JSON.
+
+    python -m still_count VIDEO_FOLDER --config CONFIG.json --output OUTPUT_FOLDER [--workers N]
+
+Progress is written to stdout as one JSON object per line; human-readable messages go to stderr.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+from .core import take_all_files, analysis_params_from_config, run_cohort, video_subject
+
+
+# Exit codes
+EXIT_OK = 0
+EXIT_PARTIAL = 1          # some videos failed or produced no data
+EXIT_USAGE = 2            # bad arguments or config (also argparse's own code)
+EXIT_NO_VIDEOS = 3        # the video folder has no videos
+EXIT_NO_RESULTS = 4       # no video produced any data
+EXIT_INTERRUPTED = 130    # Ctrl+C / SIGINT
+
+
+# main() points this at the real stdout and sends the core's print() messages to stderr
+_progress_stream = None
+
+
+@contextlib.contextmanager
+def _stdout_to_stderr():
+    """
+    Sends everything written to stdout to stderr and yields a stream on the original stdout for the
+    JSON progress lines. File descriptor 1 itself is redirected, so worker processes (whatever their
+    start method) and OpenCV/FFmpeg cannot write onto the JSON stream either.
+    """
+    try:
+        stdout_fd, stderr_fd = sys.stdout.fileno(), sys.stderr.fileno()
+    except (AttributeError, OSError, ValueError):
+        # Not backed by a file descriptor (e.g. captured in-process): only this process can be redirected
+        progress_stream = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            yield progress_stream
+        return
+
+    sys.stdout.flush()
+    progress_stream = os.fdopen(os.dup(stdout_fd), 'w')
+    os.dup2(stderr_fd, stdout_fd)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield progress_stream
+    finally:
+        sys.stdout.flush()
+        progress_stream.flush()
+        os.dup2(progress_stream.fileno(), stdout_fd)
+        progress_stream.close()
+
+
+def emit(event, **fields):
+    """Writes one progress record as a JSON line on stdout."""
+    record = {'event': event, 'time': round(time.time(), 3)}
+    record.update(fields)
+    stream = _progress_stream or sys.stdout
+    stream.write(json.dumps(record) + "\n")
+    stream.flush()
+
+
+def run_batch(video_folder, config, output_folder, n_workers=None, stop_event=None):
+    """
+    Analyses every video in video_folder with the parameters in config and writes the per-subject CSVs
+    and ALL SUBJECTS RESULTS.xlsx to output_folder (see run_cohort), reporting progress with emit().
+    Returns:
+        exit code (EXIT_OK, EXIT_PARTIAL, EXIT_NO_VIDEOS or EXIT_NO_RESULTS)
+    """
+    params = analysis_params_from_config(config)
+    if n_workers is not None:
+        params['n_workers'] = max(1, int(n_workers))
+
+    try:
+        videos, _ = take_all_files(video_folder)
+    except FileNotFoundError as e:
+        emit('error', message=str(e))
+        return EXIT_NO_VIDEOS
+    video_paths = [video_path for _, video_path in sorted(videos.items())]
+    os.makedirs(output_folder, exist_ok=True)
+    emit('start', video_folder=str(video_folder), output_folder=str(output_folder), videos=len(video_paths),
+         workers=params['n_workers'])
+
+    last_emitted = {}
+
+    def frame_progress(video_path, current_frame, total_frames):
+        # At most a few lines per second per video
+        now = time.monotonic()
+        if now - last_emitted.get(video_path, 0.0) >= 1.0 or current_frame >= total_frames:
+            last_emitted[video_path] = now
+            emit('frame_progress', video=video_path, frame=current_frame, total_frames=total_frames)
+
+    def subject_done(subject, result):
+        emit('video_done', video=result['video_path'], subject=subject, index=result['index'], total=result['total'],
+             total_immobility=float(result['seconds_immobility']), resumed=result['resumed'])
+
+    summary_table, _, failed_videos = run_cohort(
+        video_paths, params, output_folder, stop_event=stop_event,
+        frame_progress_callback=frame_progress,
+        segment_progress_callback=lambda video_path, completed, total: emit(
+            'segment_progress', video=video_path, segment=completed, total_segments=total),
+        video_start_callback=lambda video_path, index, total: emit(
+            'video_start', video=video_path, subject=video_subject(video_path), index=index, total=total),
+        video_analysed_callback=lambda video_path, completed, total: emit(
+            'video_analysed', video=video_path, completed=completed, total=total),
+        subject_done_callback=subject_done,
+        subject_failed_callback=lambda video_path, subject, message: emit(
+            'video_failed', video=video_path, subject=subject, message=message),
+        resume_callback=lambda completed, total: emit('resume', completed=completed, total=total),
+    )
+
+    if not len(summary_table):
+        emit('done', subjects=0, failed=len(failed_videos), excel=None)
+        return EXIT_NO_RESULTS
+
+    excel_path = summary_table.write_excel()
+    emit('done', subjects=len(summary_table), failed=len(failed_videos), excel=excel_path, csv=summary_table.csv_path)
+    return EXIT_PARTIAL if failed_videos else EXIT_OK
+
+
+def main(argv=None):
+    global _progress_stream
+    _progress_stream = sys.stdout
+    parser = argparse.ArgumentParser(
+        prog="python -m still_count",
+        description="Run StillCount immobility analysis on a folder of videos without the GUI. "
+                    "Progress is printed to stdout as JSON lines."
+    )
+    parser.add_argument("video_folder", help="folder containing the videos to analyse")
+    parser.add_argument("-c", "--config", required=True,
+                        help="analysis config JSON (as saved by the GUI's Save Config)")
+    parser.add_argument("-o", "--output", required=True, help="output folder for the CSVs and the results Excel")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="parallel worker processes (overrides n_workers in the config)")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+        analysis_params_from_config(config)
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        print(f"Invalid config {args.config}: {e}", file=sys.stderr)
+        emit('error', message=f"Invalid config: {e}")
+        return EXIT_USAGE
+
+    stop_event = threading.Event()
+    try:
+        with _stdout_to_stderr() as progress_stream:
+            _progress_stream = progress_stream
+            try:
+                return run_batch(args.video_folder, config, args.output, n_workers=args.workers,
+                                 stop_event=stop_event)
+            except KeyboardInterrupt:
+                stop_event.set()
+                emit('interrupted')
+                return EXIT_INTERRUPTED
+    finally:
+        _progress_stream = None
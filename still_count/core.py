@@ -8,9 +8,19 @@ import cv2
 import numpy as np
 import pandas as pd
 from pathlib import Path
-import matplotlib.pyplot as plt
-from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+import queue
 import os
+import json
+import hashlib
+import time
+import csv
+import math
+import tempfile
+from collections import deque
 
 
 # --- Core immobility Detection Functions ---
@@ -55,198 +65,1967 @@ def take_all_files(dir_path):
 
 
 
+def _clamp_roi(roi_x, roi_y, roi_width, roi_height, frame_width, frame_height):
+    actual_roi_x = max(0, min(roi_x, frame_width))
+    actual_roi_y = max(0, min(roi_y, frame_height))
+    actual_roi_width = min(roi_width, frame_width - actual_roi_x)
+    actual_roi_height = min(roi_height, frame_height - actual_roi_y)
+    return actual_roi_x, actual_roi_y, actual_roi_width, actual_roi_height
+
+
+def _count_above_threshold_inplace(frame_diff, video_threshold):
+    """
+    Number of pixels of a uint8 difference image above video_threshold, i.e.
+    np.sum(cv2.threshold(frame_diff, video_threshold, 255, cv2.THRESH_BINARY)[1] == 255).
+    The threshold is applied in place, so frame_diff holds the binary image afterwards, and the
+    count comes from cv2.countNonZero instead of a full-size boolean temporary.
+    """
+    cv2.threshold(frame_diff, video_threshold, 255, cv2.THRESH_BINARY, dst=frame_diff)
+    return cv2.countNonZero(frame_diff)
+
+
+def _strided_frame_interval(frame_interval, analysis_stride):
+    """
+    Ring length that keeps the comparison lag of `frame_interval` (frame_interval - 1 source frames)
+    when only every analysis_stride-th frame is analysed. A non-zero lag never rounds down to zero.
+    """
+    lag_frames = frame_interval - 1
+    if lag_frames <= 0 or analysis_stride <= 1:
+        return frame_interval
+    return max(1, int(round(lag_frames / analysis_stride))) + 1
+
+
+def _downscaled_size(width, height, downscale):
+    """(width, height) of an image shrunk by the downscale factor, never below one pixel."""
+    if downscale <= 1:
+        return width, height
+    return max(1, int(round(width / downscale))), max(1, int(round(height / downscale)))
+
+
+def _expand_strided_areas(sampled_areas, analysis_stride, frames_seen):
+    """Repeats every analysed value over the analysis_stride source frames it stands for."""
+    return np.repeat(np.asarray(sampled_areas, dtype=np.int64), analysis_stride)[:frames_seen].tolist()
+
+
+class _RoiMotionMeter:
+    """
+    Per-video ROI differencing state. The ROI is clamped once, on the first frame, and the grayscale
+    ring buffer (one slot per frame of the interval) and the difference image are preallocated,
+    so steady-state frames do not allocate.
+
+    With downscale > 1 the grayscale ROI is shrunk by that factor (area interpolation) before
+    differencing, and the changed-pixel count is multiplied back by the area ratio so it stays in
+    full-resolution pixels and existing immobility thresholds keep their meaning.
+    """
+
+    def __init__(self, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval, downscale=1):
+        self.roi = (roi_x, roi_y, roi_width, roi_height)
+        self.video_threshold = video_threshold
+        self.frame_interval = frame_interval
+        self.downscale = downscale
+        self.roi_box = None
+        self.frames_pushed = 0
+
+    def _allocate(self, frame):
+        h, w = frame.shape[:2]
+        self.roi_box = _clamp_roi(*self.roi, w, h)
+        _, _, roi_width, roi_height = self.roi_box
+        self.is_valid = roi_width > 0 and roi_height > 0
+        if self.is_valid:
+            scaled_width, scaled_height = _downscaled_size(roi_width, roi_height, self.downscale)
+            self.area_scale = (roi_width * roi_height) / (scaled_width * scaled_height)
+            if self.area_scale != 1:
+                self.gray_full = np.empty((roi_height, roi_width), dtype=np.uint8)
+            self.gray_ring = np.empty((self.frame_interval, scaled_height, scaled_width), dtype=np.uint8)
+            self.frame_diff = np.empty((scaled_height, scaled_width), dtype=np.uint8)
+
+    def push(self, frame):
+        """
+        Adds one decoded frame and measures the changed ROI area against the frame
+        `frame_interval - 1` positions back.
+        Returns:
+            binary_area_size: number of ROI pixels whose difference is above video_threshold (0 until the ring is full)
+            binary_diff: thresholded difference image (a reused buffer), or None if it could not be computed yet
+        """
+        if self.roi_box is None:
+            self._allocate(frame)
+        if not self.is_valid:
+            self.frames_pushed += 1
+            return 0, None
+
+        roi_x, roi_y, roi_width, roi_height = self.roi_box
+        newest_slot = self.frames_pushed % self.frame_interval
+        roi_frame = frame[roi_y:roi_y + roi_height, roi_x:roi_x + roi_width]
+        if self.area_scale != 1:
+            cv2.cvtColor(roi_frame, cv2.COLOR_BGR2GRAY, dst=self.gray_full)
+            cv2.resize(self.gray_full, self.gray_ring.shape[2:0:-1], dst=self.gray_ring[newest_slot],
+                       interpolation=cv2.INTER_AREA)
+        else:
+            cv2.cvtColor(roi_frame, cv2.COLOR_BGR2GRAY, dst=self.gray_ring[newest_slot])
+        self.frames_pushed += 1
+        if self.frames_pushed < self.frame_interval:
+            return 0, None
+
+        oldest_slot = self.frames_pushed % self.frame_interval
+        cv2.absdiff(self.gray_ring[oldest_slot], self.gray_ring[newest_slot], dst=self.frame_diff)
+
+        # Thresholding in place turns the difference into the binary image while counting
+        binary_area_size = _count_above_threshold_inplace(self.frame_diff, self.video_threshold)
+        if self.area_scale != 1:
+            binary_area_size = int(round(binary_area_size * self.area_scale))
+        return binary_area_size, self.frame_diff
+
+
+# --- Cancellation ---
+
+# stop_event is checked every STOP_CHECK_FRAMES decoded frames (a few ms of work), and the
+# parallel runners poll it every STOP_POLL_SECONDS while waiting for their workers
+STOP_CHECK_FRAMES = 8
+STOP_POLL_SECONDS = 0.1
+
+# Set in each worker process by _init_worker_stop_event (ProcessPoolExecutor initializer)
+_worker_stop_event = None
+
+
+def _init_worker_stop_event(stop_event):
+    global _worker_stop_event
+    _worker_stop_event = stop_event
+
+
+def _stop_requested(stop_event):
+    return stop_event is not None and stop_event.is_set()
+
+
+def _completed_until_stopped(futures, stop_event, worker_stop_event):
+    """
+    Yields futures as they finish, like as_completed. While waiting it polls stop_event; once that is
+    set, worker_stop_event (a multiprocessing.Event shared with the pool) is set so running workers
+    stop within STOP_CHECK_FRAMES frames, and futures that have not started are cancelled.
+    """
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=STOP_POLL_SECONDS, return_when=FIRST_COMPLETED)
+        if _stop_requested(stop_event) and not worker_stop_event.is_set():
+            worker_stop_event.set()
+            for future in pending:
+                future.cancel()
+        for future in done:
+            if not future.cancelled():
+                yield future
+
+
+# --- Binary area cache ---
+
+BINARY_AREA_CACHE_DIR = ".stillcount_cache"
+_BINARY_AREA_CACHE_VERSION = 1
+
+
+def _fast_file_hash(file_path, chunk_size=1 << 20):
+    """Hashes the first, middle and last chunk of a file: cheap even for multi-GB videos."""
+    file_size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for offset in sorted({0, max(0, file_size // 2 - chunk_size // 2), max(0, file_size - chunk_size)}):
+            f.seek(offset)
+            digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+
+def binary_area_cache_key(video_path, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval,
+                          analysis_stride=1, downscale=1):
+    """
+    Key identifying a binary-area series: the video file (size, mtime and a fast content hash)
+    combined with the pixel-level parameters that the series depends on.
+    """
+    file_stat = os.stat(video_path)
+    key_fields = {
+        'version': _BINARY_AREA_CACHE_VERSION,
+        'size': file_stat.st_size,
+        'mtime_ns': file_stat.st_mtime_ns,
+        'hash': _fast_file_hash(video_path),
+        'roi': [int(roi_x), int(roi_y), int(roi_width), int(roi_height)],
+        'video_threshold': float(video_threshold),
+        'frame_interval': int(frame_interval),
+    }
+    if analysis_stride != 1:
+        key_fields['analysis_stride'] = int(analysis_stride)
+    if downscale != 1:
+        key_fields['downscale'] = float(downscale)
+    return hashlib.blake2b(json.dumps(key_fields, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def _binary_area_cache_path(video_path, cache_key):
+    video_path = Path(video_path)
+    return video_path.parent / BINARY_AREA_CACHE_DIR / f"{video_path.stem}_{cache_key}.npz"
+
+
+def load_cached_binary_areas(video_path, cache_key):
+    """
+    Returns:
+        (fps, binary_area_series) stored under cache_key, or None if there is no usable cache entry
+    """
+    return _read_binary_areas_file(_binary_area_cache_path(video_path, cache_key))
+
+
+def save_cached_binary_areas(video_path, cache_key, fps, binary_area_series):
+    _write_binary_areas_file(_binary_area_cache_path(video_path, cache_key), fps, binary_area_series)
+
+
+def _read_binary_areas_file(npz_path):
+    npz_path = Path(npz_path)
+    if not npz_path.exists():
+        return None
+    try:
+        with np.load(npz_path) as cached:
+            fps = float(cached['fps'])
+            binary_areas = cached['binary_areas'].astype(np.int64)
+    except Exception as e:
+        print(f"Warning: Ignoring unreadable binary area file {npz_path}: {e}")
+        return None
+    return fps, pd.Series(binary_areas)
+
+
+def _write_binary_areas_file(npz_path, fps, binary_area_series):
+    # Written to a temporary file first so a crash never leaves a truncated .npz behind
+    npz_path = Path(npz_path)
+    temp_path = npz_path.with_name(npz_path.name + ".tmp")
+    try:
+        os.makedirs(npz_path.parent, exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(f, fps=np.float64(fps), binary_areas=np.asarray(binary_area_series, dtype=np.uint32))
+        os.replace(temp_path, npz_path)
+        return True
+    except OSError as e:
+        print(f"Warning: Could not write binary area file {npz_path}: {e}")
+        return False
+
+
+# --- Resumable runs ---
+
+RUN_MANIFEST_NAME = "stillcount_run.json"
+RUN_CHECKPOINT_DIR = ".stillcount_checkpoints"
+_RUN_MANIFEST_VERSION = 1
+
+
+def _video_fingerprint(video_path):
+    file_stat = os.stat(video_path)
+    return {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns}
+
+
+def _write_json_atomic(json_path, data):
+    temp_path = Path(str(json_path) + ".tmp")
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, json_path)
+
+
+def load_run_manifest(output_folder, motion_params, scoring_params, video_paths):
+    """
+    Loads the run manifest (stillcount_run.json) of output_folder, or starts a new one.
+    Checkpoints of a previous run are kept only if it used the same motion_params (everything the
+    binary areas depend on: ROIs, video threshold, frame interval, stride, downscale); scoring_params
+    are recorded for reference and may change between runs, since subjects are re-scored from the
+    checkpoints. Videos in video_paths that are not in the manifest yet are added as 'pending'.
+    Returns:
+        manifest dict (save it with save_run_manifest)
+    """
+    manifest_path = Path(output_folder) / RUN_MANIFEST_NAME
+    manifest = None
+    if manifest_path.exists():
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable run manifest {manifest_path}: {e}")
+    # Round-trip through JSON so tuples and lists compare equal
+    motion_params = json.loads(json.dumps(motion_params))
+    if (manifest is None or manifest.get('version') != _RUN_MANIFEST_VERSION
+            or manifest.get('motion_params') != motion_params):
+        manifest = {'version': _RUN_MANIFEST_VERSION, 'motion_params': motion_params, 'videos': {}}
+    manifest['scoring_params'] = json.loads(json.dumps(scoring_params))
+    for video_path in video_paths:
+        manifest['videos'].setdefault(os.path.abspath(video_path), {'status': 'pending'})
+    save_run_manifest(output_folder, manifest)
+    return manifest
+
+
+def save_run_manifest(output_folder, manifest):
+    try:
+        _write_json_atomic(Path(output_folder) / RUN_MANIFEST_NAME, manifest)
+    except OSError as e:
+        print(f"Warning: Could not write run manifest in {output_folder}: {e}")
+
+
+def load_completed_video(output_folder, manifest, video_path):
+    """
+    Returns:
+        (fps, {subject: (roi_name, binary_area_series)}) from the checkpoints of a video the manifest
+        marks as done, or None if it is not done, has changed on disk or a checkpoint is unusable
+    """
+    entry = manifest['videos'].get(os.path.abspath(video_path))
+    if not entry or entry.get('status') != 'done':
+        return None
+    try:
+        if _video_fingerprint(video_path) != entry.get('video'):
+            return None
+    except OSError:
+        return None
+
+    fps = None
+    subjects = {}
+    for subject, subject_entry in entry.get('subjects', {}).items():
+        checkpoint = _read_binary_areas_file(Path(output_folder) / RUN_CHECKPOINT_DIR / subject_entry['checkpoint'])
+        if checkpoint is None:
+            return None
+        fps, binary_area_series = checkpoint
+        subjects[subject] = (subject_entry.get('roi_name'), binary_area_series)
+    if not subjects:
+        return None
+    return fps, subjects
+
+
+def record_completed_video(output_folder, manifest, video_path, fps, subjects, marked=None):
+    """
+    Checkpoints the binary areas of a finished video and marks it done in the manifest (saved to disk).
+    Args:
+        subjects: {subject: (roi_name, binary_area_series)}
+        marked: optional JSON-serialisable record of how the video's marked videos were written
+            (immobility parameters and video options), to tell when they go out of date
+    """
+    subject_entries = {}
+    for subject, (roi_name, binary_area_series) in subjects.items():
+        checkpoint_name = f"{subject}.npz"
+        if not _write_binary_areas_file(Path(output_folder) / RUN_CHECKPOINT_DIR / checkpoint_name, fps, binary_area_series):
+            return
+        subject_entries[subject] = {'roi_name': roi_name, 'checkpoint': checkpoint_name}
+    manifest['videos'][os.path.abspath(video_path)] = {
+        'status': 'done',
+        'video': _video_fingerprint(video_path),
+        'fps': float(fps),
+        'subjects': subject_entries,
+        'marked': marked,
+    }
+    save_run_manifest(output_folder, manifest)
+
+
 def run_background_subtraction_for_analysis(video_path, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval,
-                                            progress_callback=None, frame_display_callback=None, stop_event=None):
+                                            progress_callback=None, frame_display_callback=None, stop_event=None,
+                                            use_cache=False, analysis_stride=1, downscale=1, max_frames=None,
+                                            preview_ready=None, keep_partial=False, mark_video_path=None,
+                                            mark_params=None, mark_video_options=None):
+    """
+    Measures, for every frame, how many ROI pixels changed by more than video_threshold compared with
+    the frame `frame_interval - 1` frames earlier.
+
+    With analysis_stride > 1 only every analysis_stride-th frame is decoded and differenced (the others
+    are skipped with cap.grab()); the comparison lag is converted so it covers the same time, and each
+    analysed value is repeated over the skipped frames, so the series still has one value per source
+    frame and frame-based windows and indices keep their meaning.
+
+    With downscale > 1 the ROI is shrunk by that factor before differencing; values are reported in
+    full-resolution pixels, so the same immobility threshold applies.
+    max_frames limits the analysis to the first max_frames frames of the video.
+
+    frame_display_callback receives a preview frame (ROI outline plus binary overlay) about twice
+    per second of video; if preview_ready is given, the preview is only built when it returns True
+    (e.g. once the UI has consumed the previous one).
+
+    stop_event is checked every STOP_CHECK_FRAMES frames. When it is set the run stops and returns an
+    empty series, or with keep_partial=True the values of the frames analysed so far (not padded to
+    the video length and never cached).
+
+    With mark_video_path and mark_params=(immobility_threshold, window_size) the marked video of
+    create_immobility_mark_video is written during the same decode pass, so the source does not have to
+    be decoded again after detect_immobility (see _ImmobilityMarkWriter); mark_video_options is an optional
+    dict of its codec, downscale and frame_stride.
+    Returns:
+        fps: float
+        binary_area_series: pd.Series with one value per frame
+    """
+    fps, binary_area_series_by_roi = run_background_subtraction_multi_roi(
+        video_path, {'roi': (roi_x, roi_y, roi_width, roi_height)}, video_threshold, frame_interval,
+        progress_callback=progress_callback, frame_display_callback=frame_display_callback, stop_event=stop_event,
+        use_cache=use_cache, analysis_stride=analysis_stride, downscale=downscale, max_frames=max_frames,
+        preview_ready=preview_ready, keep_partial=keep_partial,
+        mark_video_paths={'roi': mark_video_path} if mark_video_path else None, mark_params=mark_params,
+        mark_video_options=mark_video_options
+    )
+    return fps, binary_area_series_by_roi['roi']
+
+
+def run_background_subtraction_multi_roi(video_path, rois, video_threshold, frame_interval,
+                                         progress_callback=None, frame_display_callback=None, stop_event=None,
+                                         use_cache=False, analysis_stride=1, downscale=1, max_frames=None,
+                                         preview_ready=None, keep_partial=False, mark_video_paths=None,
+                                         mark_params=None, mark_video_options=None):
+    """
+    Same as run_background_subtraction_for_analysis for several ROIs of one video (e.g. one per
+    chamber of a multi-arena rig), decoding the video only once.
+    Args:
+        rois: dict of ROI name -> (roi_x, roi_y, roi_width, roi_height)
+        mark_video_paths: optional dict of ROI name -> marked video path, written with mark_params
+    Returns:
+        fps: float
+        binary_area_series_by_roi: dict of ROI name -> pd.Series with one value per frame
+    """
+    analysis_stride = max(1, int(analysis_stride))
+    use_cache = use_cache and max_frames is None
+    mark_video_paths = mark_video_paths or {}
+    cache_keys = {}
+    if use_cache and not mark_video_paths:
+        cached_results = {}
+        for roi_name, roi in rois.items():
+            cache_keys[roi_name] = binary_area_cache_key(video_path, *roi, video_threshold, frame_interval,
+                                                         analysis_stride, downscale)
+            cached = load_cached_binary_areas(video_path, cache_keys[roi_name])
+            if cached is not None:
+                cached_results[roi_name] = cached
+        if len(cached_results) == len(rois) and rois:
+            fps = next(iter(cached_results.values()))[0]
+            return fps, {roi_name: cached_results[roi_name][1] for roi_name in rois}
+    elif use_cache:
+        # The marked video needs the decode pass anyway; the fresh values still refresh the cache
+        for roi_name, roi in rois.items():
+            cache_keys[roi_name] = binary_area_cache_key(video_path, *roi, video_threshold, frame_interval,
+                                                         analysis_stride, downscale)
+
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print(f"Error: Could not open video {video_path} for background subtraction.")
     
     fps = cap.get(cv2.CAP_PROP_FPS)
 
-    frame_buffer = deque(maxlen=frame_interval)
-    binary_areas = []
+    ring_length = _strided_frame_interval(frame_interval, analysis_stride)
+    motion_meters = {
+        roi_name: _RoiMotionMeter(*roi, video_threshold, ring_length, downscale)
+        for roi_name, roi in rois.items()
+    }
+    binary_areas_by_roi = {roi_name: [] for roi_name in rois}
+    mark_writers = {
+        roi_name: _ImmobilityMarkWriter(mark_video_path, fps, *mark_params, **(mark_video_options or {}))
+        for roi_name, mark_video_path in mark_video_paths.items()
+    }
 
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    current_frame_idx = 0
+    if max_frames is not None:
+        total_frames = min(total_frames, int(max_frames))
 
     live_preview_target_fps = 2
-    display_interval = max(1, int(fps/ live_preview_target_fps))
+    display_interval = max(1, int(fps/ live_preview_target_fps / analysis_stride))
 
-    while True:
-        ret, current_frame = cap.read()
-        if not ret:
-            remaining_frames = total_frames - len(binary_areas)
-            binary_areas.extend([0] * remaining_frames)
-            break
+    def push_to_mark_writers(current_frame):
+        marked_frames = []
+        for roi_name, mark_writer in mark_writers.items():
+            frame_resized = mark_writer.push(current_frame, binary_areas_by_roi[roi_name][-1])
+            if frame_resized is not None:
+                marked_frames.append((mark_writer, frame_resized))
+        return marked_frames or None
 
-        h, w, _ = current_frame.shape
-        actual_roi_x = max(0, min(roi_x, w))
-        actual_roi_y = max(0, min(roi_y, h))
-        actual_roi_width = min(roi_width, w - actual_roi_x)
-        actual_roi_height = min(roi_height, h - actual_roi_y)
+    def analyse_frame(frame_idx, current_frame, analysed):
+        # Runs in this thread while the pipeline's reader decodes the next frames
+        if not analysed:
+            # Skipped frame decoded only for the marked video: it repeats the last value
+            return push_to_mark_writers(current_frame)
 
-        binary_diff = None
-        if actual_roi_width <= 0 or actual_roi_height <= 0:
-            binary_areas.append(0)
-            frame_buffer.append(np.zeros((10,10), dtype=np.uint8))
-        else:
-            roi_frame = current_frame[actual_roi_y:actual_roi_y + actual_roi_height,
-                                      actual_roi_x:actual_roi_x + actual_roi_width]
-            roi_frame_gray = cv2.cvtColor(roi_frame, cv2.COLOR_BGR2GRAY)
-            frame_buffer.append(roi_frame_gray)
-
-        if len(frame_buffer) == frame_interval:
-            frame_diff = cv2.absdiff(frame_buffer[0], frame_buffer[-1])
-            
-             # Threshold the difference to get the binary image
-            _, binary_diff = cv2.threshold(frame_diff, video_threshold, 255, cv2.THRESH_BINARY)
-        
-
-            binary_area_size = np.sum(binary_diff == 255)
-            
-            binary_areas.append(binary_area_size)
-            
-        
-            
-        else:
-            binary_areas.append(0)
+        binary_diffs = {}
+        for roi_name, motion_meter in motion_meters.items():
+            binary_area_size, binary_diffs[roi_name] = motion_meter.push(current_frame)
+            binary_areas_by_roi[roi_name].append(binary_area_size)
+        marked_frames = push_to_mark_writers(current_frame)
 
-        if frame_display_callback and current_frame_idx % display_interval == 0:
+        # The preview copy and overlay are only built when someone will look at them
+        if (frame_display_callback and (frame_idx // analysis_stride) % display_interval == 0
+                and (preview_ready is None or preview_ready())):
             display_frame = current_frame.copy()
-            cv2.rectangle(display_frame, (actual_roi_x, actual_roi_y),(actual_roi_x + actual_roi_width, actual_roi_y + actual_roi_height), (0, 255, 0), 2)
-            
-            if len(frame_buffer) == frame_interval and binary_diff is not None:
-                binary_diff_bgr = cv2.cvtColor(binary_diff, cv2.COLOR_GRAY2BGR)
-                alpha = 0.5
-                display_frame[actual_roi_y:actual_roi_y + actual_roi_height,
-                              actual_roi_x:actual_roi_x + actual_roi_width] = cv2.addWeighted(
-                                  display_frame[actual_roi_y:actual_roi_y + actual_roi_height,
-                                                actual_roi_x:actual_roi_x + actual_roi_width],
-                                  1 - alpha,
-                                  binary_diff_bgr,
-                                  alpha,
-                                  0)
+            for roi_name, motion_meter in motion_meters.items():
+                actual_roi_x, actual_roi_y, actual_roi_width, actual_roi_height = motion_meter.roi_box
+                cv2.rectangle(display_frame, (actual_roi_x, actual_roi_y),(actual_roi_x + actual_roi_width, actual_roi_y + actual_roi_height), (0, 255, 0), 2)
+
+                binary_diff = binary_diffs[roi_name]
+                if binary_diff is not None:
+                    if binary_diff.shape != (actual_roi_height, actual_roi_width):
+                        binary_diff = cv2.resize(binary_diff, (actual_roi_width, actual_roi_height), interpolation=cv2.INTER_NEAREST)
+                    binary_diff_bgr = cv2.cvtColor(binary_diff, cv2.COLOR_GRAY2BGR)
+                    alpha = 0.5
+                    display_frame[actual_roi_y:actual_roi_y + actual_roi_height,
+                                  actual_roi_x:actual_roi_x + actual_roi_width] = cv2.addWeighted(
+                                      display_frame[actual_roi_y:actual_roi_y + actual_roi_height,
+                                                    actual_roi_x:actual_roi_x + actual_roi_width],
+                                      1 - alpha,
+                                      binary_diff_bgr,
+                                      alpha,
+                                      0)
 
             frame_display_callback(display_frame)
 
         if progress_callback:
-            progress_callback(current_frame_idx + 1, total_frames)
+            progress_callback(min(frame_idx + analysis_stride, total_frames), total_frames)
+        return marked_frames
+
+    def write_marked_frames(marked_frames):
+        for mark_writer, frame_resized in marked_frames:
+            mark_writer.write(frame_resized)
+
+    # Skipped frames are only grabbed (no colour conversion, copy or differencing) unless a marked
+    # video needs their pixels; encoding the marked videos runs in the pipeline's writer thread.
+    try:
+        frames_seen, stopped = run_frame_pipeline(
+            cap, analyse_frame, write_marked_frames if mark_writers else None, stop_event=stop_event,
+            max_frames=total_frames if max_frames is not None else None, frame_stride=analysis_stride,
+            decode_skipped=bool(mark_writers)
+        )
+    except Exception:
+        for mark_writer in mark_writers.values():
+            mark_writer.discard()
+        raise
+    finally:
+        cap.release()
 
-        current_frame_idx += 1
+    stopped = stopped or _stop_requested(stop_event)
+    binary_area_series_by_roi = {}
+    for roi_name, binary_areas in binary_areas_by_roi.items():
+        if stopped and not keep_partial:
+            binary_area_series_by_roi[roi_name] = pd.Series([], dtype=np.int64)
+            continue
+        if analysis_stride > 1:
+            binary_areas = _expand_strided_areas(binary_areas, analysis_stride, frames_seen)
+        if stopped:
+            binary_area_series_by_roi[roi_name] = pd.Series(binary_areas[:frames_seen], dtype=np.int64)
+            continue
+        if max_frames is not None:
+            del binary_areas[total_frames:]
+        remaining_frames = total_frames - len(binary_areas)
+        binary_areas.extend([0] * remaining_frames)
+
+        binary_area_series = pd.Series(binary_areas)
+        if use_cache and not binary_area_series.empty and not stopped:
+            save_cached_binary_areas(video_path, cache_keys[roi_name], fps, binary_area_series)
+        binary_area_series_by_roi[roi_name] = binary_area_series
+
+    for roi_name, mark_writer in mark_writers.items():
+        if stopped:
+            mark_writer.discard()
+        else:
+            mark_writer.finish(binary_area_series_by_roi[roi_name])
+
+    return fps, binary_area_series_by_roi
+
+def compare_downscale_agreement(video_path, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval,
+                                immobility_threshold, window_size, downscale, max_frames=None):
+    """
+    Analyses (the first max_frames frames of) a sample video at full resolution and downscaled, and
+    compares speed and immobility scoring.
+    Returns:
+        dict with full_resolution_seconds, downscaled_seconds, speedup, agreement (fraction of frames
+        with the same immobility state) and immobility_seconds_full / immobility_seconds_downscaled
+    """
+    timings, masks, immobility_seconds = [], [], []
+    for factor in (1, downscale):
+        start_time = time.perf_counter()
+        fps, binary_area_series = run_background_subtraction_for_analysis(
+            video_path, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval,
+            downscale=factor, max_frames=max_frames
+        )
+        timings.append(time.perf_counter() - start_time)
+        persistent_immobility, _, seconds_immobility = detect_immobility(binary_area_series, immobility_threshold, window_size, fps)
+        masks.append(persistent_immobility)
+        immobility_seconds.append(seconds_immobility)
+
+    agreement = float(np.mean(masks[0] == masks[1])) if len(masks[0]) else 1.0
+    return {
+        'full_resolution_seconds': timings[0],
+        'downscaled_seconds': timings[1],
+        'speedup': timings[0] / timings[1] if timings[1] > 0 else float('inf'),
+        'agreement': agreement,
+        'immobility_seconds_full': immobility_seconds[0],
+        'immobility_seconds_downscaled': immobility_seconds[1],
+    }
+
+
+def _failed_analysis_result(rois=None):
+    # What the batch runner reports for a video that could not be analysed: an empty series (per ROI)
+    if rois is not None:
+        return 0.0, {roi_name: pd.Series([], dtype=np.int64) for roi_name in rois}
+    return 0.0, pd.Series(dtype=np.int64)
+
+
+def _background_subtraction_worker(video_path, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval,
+                                   use_cache=False, analysis_stride=1, downscale=1, rois=None, stop_event=None,
+                                   mark_params=None, mark_video_options=None, mark_video_folder=None):
+    # Runs in a worker process: no GUI callbacks can cross the process boundary, and the stop event
+    # is the pool's multiprocessing.Event unless one is passed for in-process runs.
+    if stop_event is None:
+        stop_event = _worker_stop_event
+    mark_codec = (mark_video_options or {}).get('codec', MARKED_VIDEO_DEFAULT_CODEC)
+    if rois is not None:
+        try:
+            mark_video_paths = None
+            if mark_params is not None:
+                mark_video_paths = {roi_name: marked_video_path(video_path, roi_name, mark_video_folder, mark_codec)
+                                    for roi_name in rois}
+            return run_background_subtraction_multi_roi(video_path, rois, video_threshold, frame_interval,
+                                                        stop_event=stop_event, use_cache=use_cache,
+                                                        analysis_stride=analysis_stride, downscale=downscale,
+                                                        mark_video_paths=mark_video_paths, mark_params=mark_params,
+                                                        mark_video_options=mark_video_options)
+        except Exception as e:
+            print(f"Error analysing {video_path}: {e}")
+            return _failed_analysis_result(rois)
+    try:
+        return run_background_subtraction_for_analysis(video_path, roi_x, roi_y, roi_width, roi_height,
+                                                       video_threshold, frame_interval, stop_event=stop_event,
+                                                       use_cache=use_cache, analysis_stride=analysis_stride,
+                                                       downscale=downscale,
+                                                       mark_video_path=marked_video_path(video_path, None, mark_video_folder,
+                                                                                         mark_codec) if mark_params else None,
+                                                       mark_params=mark_params, mark_video_options=mark_video_options)
+    except Exception as e:
+        print(f"Error: Background subtraction failed for {video_path}: {e}")
+        return _failed_analysis_result()
+
+
+def run_background_subtraction_batch(video_paths, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval,
+                                     n_workers=None, progress_callback=None, stop_event=None, use_cache=False,
+                                     analysis_stride=1, downscale=1, rois=None, mark_params=None,
+                                     mark_video_options=None, mark_video_folder=None, result_callback=None):
+    """
+    Runs run_background_subtraction_for_analysis on several videos in parallel worker processes.
+
+    Args:
+        video_paths: list of video paths, all analysed with the same ROI and thresholds
+        n_workers: number of worker processes (defaults to the number of CPUs); 1 runs serially in-process
+        progress_callback: called as progress_callback(video_path, completed, total) in the calling
+            thread every time a video finishes
+        result_callback: called as result_callback(video_path, result) in the calling thread as soon as a
+            video finishes (before progress_callback), e.g. to checkpoint and score it while the others run
+        stop_event: threading.Event; once set, videos that have not started yet are cancelled and
+            running ones stop within STOP_CHECK_FRAMES frames (returning an empty series)
+        use_cache: reuse/store binary areas in the .stillcount_cache folder next to each video
+        analysis_stride: analyse every analysis_stride-th frame (see run_background_subtraction_for_analysis)
+        downscale: ROI downscale factor (see run_background_subtraction_for_analysis)
+        rois: optional dict of ROI name -> (roi_x, roi_y, roi_width, roi_height); when given, every video
+            is analysed with run_background_subtraction_multi_roi and the single ROI arguments are ignored
+        mark_params: optional (immobility_threshold, window_size); each worker then also writes the
+            marked videos (see marked_video_path) during its decode pass
+        mark_video_options: optional dict of codec, downscale and frame_stride for those marked videos
+        mark_video_folder: folder for those marked videos (default: "Marked videos" next to each video)
+    Returns:
+        results: list of (fps, binary_area_series) tuples in the same order as video_paths
+                 ((fps, binary_area_series_by_roi) with rois; None for videos cancelled through stop_event).
+                 Videos whose worker process died (e.g. killed when out of memory) get empty series.
+    """
+    video_paths = list(video_paths)
+    total = len(video_paths)
+    results = [None] * total
+    if total == 0:
+        return results
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(int(n_workers), total))
+
+    if n_workers == 1:
+        for idx, video_path in enumerate(video_paths):
+            if stop_event is not None and stop_event.is_set():
+                break
+            results[idx] = _background_subtraction_worker(video_path, roi_x, roi_y, roi_width, roi_height,
+                                                          video_threshold, frame_interval, use_cache, analysis_stride,
+                                                          downscale, rois, stop_event, mark_params,
+                                                          mark_video_options, mark_video_folder)
+            if result_callback:
+                result_callback(video_path, results[idx])
+            if progress_callback:
+                progress_callback(video_path, idx + 1, total)
+        return results
+
+    completed = 0
+    worker_stop_event = multiprocessing.Event()
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker_stop_event,
+                             initargs=(worker_stop_event,)) as executor:
+        future_to_idx = {
+            executor.submit(_background_subtraction_worker, video_path, roi_x, roi_y, roi_width, roi_height,
+                            video_threshold, frame_interval, use_cache, analysis_stride, downscale, rois,
+                            mark_params=mark_params, mark_video_options=mark_video_options,
+                            mark_video_folder=mark_video_folder): idx
+            for idx, video_path in enumerate(video_paths)
+        }
+        for future in _completed_until_stopped(future_to_idx, stop_event, worker_stop_event):
+            idx = future_to_idx[future]
+            try:
+                results[idx] = future.result()
+            except BrokenProcessPool as e:
+                # A killed worker breaks the whole pool: this and every unfinished video fail
+                print(f"Error: Worker process for {video_paths[idx]} terminated abruptly: {e}")
+                results[idx] = _failed_analysis_result(rois)
+            completed += 1
+            if result_callback:
+                result_callback(video_paths[idx], results[idx])
+            if progress_callback:
+                progress_callback(video_paths[idx], completed, total)
+
+    return results
+
+
+def _seek_exact(cap, frame_idx):
+    """
+    Seeks cap so that the next read returns frame frame_idx. CAP_PROP_POS_FRAMES only echoes the
+    requested frame, so the landing point is checked on the frame before it instead: its timestamp
+    (CAP_PROP_POS_MSEC, taken from the decoded frame) must be (frame_idx - 1) / fps.
+    Returns:
+        False if the seek could not be verified (inexact seeks, variable frame rate files); the
+        position of cap is then undefined
+    """
+    if frame_idx <= 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return True
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps or fps <= 0:
+        return False
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx - 1)
+    if not cap.grab():
+        return False
+    expected_msec = (frame_idx - 1) * 1000.0 / fps
+    return abs(cap.get(cv2.CAP_PROP_POS_MSEC) - expected_msec) < 500.0 / fps
+
+
+def _scan_video_segment(video_path, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval,
+                        start_frame, stop_frame, analysis_stride=1, downscale=1, stop_event=None):
+    """
+    Analysed binary areas for frames [start_frame, stop_frame) of one video (stop_frame=None reads to the end).
+    start_frame and stop_frame are multiples of analysis_stride. Decoding starts one comparison lag early
+    so the ring buffer holds exactly what a sequential run would hold at start_frame.
+    Returns:
+        binary_areas: one value per analysed frame
+        frames_seen: number of source frames of the segment that could be read (fewer if stopped)
+    """
+    if stop_event is None:
+        stop_event = _worker_stop_event
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Error: Could not open video {video_path} for segment {start_frame}-{stop_frame}.")
+        return [], 0
+
+    sample_interval = _strided_frame_interval(frame_interval, analysis_stride)
+    lead_in = min(start_frame, (sample_interval - 1) * analysis_stride)
+    frame_idx = start_frame - lead_in
+    if frame_idx > 0 and not _seek_exact(cap, frame_idx):
+        # Seek could not be verified (e.g. variable frame rate): decode forward from the first frame instead
+        print(f"Warning: Could not seek exactly in {video_path}; segment {start_frame}-{stop_frame} is decoded from the first frame.")
+        cap.release()
+        cap = cv2.VideoCapture(video_path)
+        for _ in range(frame_idx):
+            if not cap.grab():
+                cap.release()
+                return [], 0
+
+    motion_meter = _RoiMotionMeter(roi_x, roi_y, roi_width, roi_height, video_threshold, sample_interval, downscale)
+    binary_areas = []
+    frames_seen = 0
+    current_frame = None
+    reached_end = False
+    analysed_count = 0
+    while not reached_end and (stop_frame is None or frame_idx < stop_frame):
+        if analysed_count % STOP_CHECK_FRAMES == 0 and _stop_requested(stop_event):
+            break
+        analysed_count += 1
+
+        ret, current_frame = cap.read(current_frame)
+        if not ret:
+            break
+        binary_area_size, _ = motion_meter.push(current_frame)
+        in_segment = frame_idx >= start_frame
+        if in_segment:
+            binary_areas.append(binary_area_size)
+            frames_seen += 1
+        frame_idx += 1
+
+        for _ in range(analysis_stride - 1):
+            if not cap.grab():
+                reached_end = True
+                break
+            if in_segment:
+                frames_seen += 1
+            frame_idx += 1
 
     cap.release()
-    cv2.destroyAllWindows()
+    return binary_areas, frames_seen
 
-    
 
-    return fps, pd.Series(binary_areas)
+def run_background_subtraction_segmented(video_path, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval,
+                                         n_segments=None, n_workers=None, progress_callback=None, stop_event=None,
+                                         use_cache=False, analysis_stride=1, downscale=1):
+    """
+    Same output as run_background_subtraction_for_analysis, but the video is split into n_segments
+    frame ranges that are decoded and differenced in parallel worker processes and stitched back in order.
+    Every segment's seek is checked against the frame timestamps; where that fails (variable frame rate
+    or files the backend cannot seek exactly) the segment decodes from the first frame, so the output
+    is unchanged but most of the speed-up is lost: segment mode is meant for constant frame rate files.
+
+    Args:
+        n_segments: number of frame ranges (defaults to n_workers)
+        n_workers: number of worker processes (defaults to the number of CPUs)
+        progress_callback: called as progress_callback(completed_segments, total_segments)
+        stop_event: threading.Event; once set, segments that have not started yet are cancelled,
+                    running ones stop within STOP_CHECK_FRAMES frames and an empty series is returned
+        use_cache: reuse/store binary areas in the .stillcount_cache folder next to the video
+        analysis_stride: analyse every analysis_stride-th frame (see run_background_subtraction_for_analysis)
+        downscale: ROI downscale factor (see run_background_subtraction_for_analysis)
+    Returns:
+        fps: float
+        binary_area_series: pd.Series with one value per frame
+    """
+    analysis_stride = max(1, int(analysis_stride))
+    if use_cache:
+        cache_key = binary_area_cache_key(video_path, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval,
+                                          analysis_stride, downscale)
+        cached = load_cached_binary_areas(video_path, cache_key)
+        if cached is not None:
+            return cached
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Error: Could not open video {video_path} for background subtraction.")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, int(n_workers))
+    if n_segments is None:
+        n_segments = n_workers
+    # Segments shorter than the frame interval would spend most of their time on lead-in frames
+    n_segments = max(1, min(int(n_segments), total_frames // (max(1, frame_interval) * analysis_stride)))
+
+    if n_segments == 1 or n_workers == 1:
+        return run_background_subtraction_for_analysis(video_path, roi_x, roi_y, roi_width, roi_height,
+                                                       video_threshold, frame_interval, stop_event=stop_event,
+                                                       use_cache=use_cache, analysis_stride=analysis_stride,
+                                                       downscale=downscale)
+
+    # Segment boundaries fall on analysed frames so every segment samples the same frames as a sequential run
+    segment_length = (total_frames // n_segments) // analysis_stride * analysis_stride
+    boundaries = [i * segment_length for i in range(n_segments)] + [None]
+    segments = list(zip(boundaries[:-1], boundaries[1:]))
+
+    segment_areas = [None] * n_segments
+    completed = 0
+    worker_stop_event = multiprocessing.Event()
+    with ProcessPoolExecutor(max_workers=min(n_workers, n_segments), initializer=_init_worker_stop_event,
+                             initargs=(worker_stop_event,)) as executor:
+        future_to_idx = {
+            executor.submit(_scan_video_segment, video_path, roi_x, roi_y, roi_width, roi_height,
+                            video_threshold, frame_interval, start, stop, analysis_stride, downscale): idx
+            for idx, (start, stop) in enumerate(segments)
+        }
+        for future in _completed_until_stopped(future_to_idx, stop_event, worker_stop_event):
+            try:
+                segment_areas[future_to_idx[future]] = future.result()
+            except BrokenProcessPool as e:
+                print(f"Error: Worker process for a segment of {video_path} terminated abruptly: {e}")
+            completed += 1
+            if progress_callback:
+                progress_callback(completed, n_segments)
+
+    if _stop_requested(stop_event) or any(areas is None for areas in segment_areas):
+        return fps, pd.Series(dtype=np.int64)
+
+    # A segment that ends early means decoding failed there; a sequential run stops at that
+    # frame too, so later segments are dropped and the remainder is zero-padded.
+    binary_areas = []
+    for (start, stop), (areas, frames_seen) in zip(segments, segment_areas):
+        if analysis_stride > 1:
+            areas = _expand_strided_areas(areas, analysis_stride, frames_seen)
+        binary_areas.extend(areas)
+        if stop is not None and frames_seen < stop - start:
+            break
+    binary_areas.extend([0] * (total_frames - len(binary_areas)))
+
+    binary_area_series = pd.Series(binary_areas)
+    if use_cache and not binary_area_series.empty:
+        save_cached_binary_areas(video_path, cache_key, fps, binary_area_series)
+
+    return fps, binary_area_series
+
+
+def detect_immobility_array(binary_areas, immobility_threshold, window_size):
+    """
+    NumPy engine behind detect_immobility.
+
+    Args:
+        binary_areas: 1-D array (one subject) or 2-D array with one row per subject
+        immobility_threshold: frames with fewer changed pixels than this are still
+        window_size: number of consecutive still frames needed for immobility
+    Returns:
+        persistent_immobility: boolean array with the shape of binary_areas, True on every frame that
+            starts a run of window_size still frames (the last window_size - 1 frames are always False)
+    """
+    window_size = int(window_size)
+    if window_size < 1:
+        raise ValueError(f"window_size must be at least 1, got {window_size}")
+
+    is_instantly_still = np.asarray(binary_areas) < immobility_threshold
+    n_frames = is_instantly_still.shape[-1]
+    persistent_immobility = np.zeros(is_instantly_still.shape, dtype=bool)
+    if n_frames < window_size:
+        return persistent_immobility
+
+    # still_counts[..., i] = number of still frames before frame i; a window is fully still when
+    # the count grows by window_size across it.
+    still_counts = np.zeros(is_instantly_still.shape[:-1] + (n_frames + 1,), dtype=np.int64)
+    np.cumsum(is_instantly_still, axis=-1, out=still_counts[..., 1:])
+    window_sums = still_counts[..., window_size:] - still_counts[..., :-window_size]
+    persistent_immobility[..., :n_frames - window_size + 1] = window_sums == window_size
+    return persistent_immobility
+
 
 def detect_immobility(frames_moving, immobility_threshold, window_size, frame_rate):
-    if frames_moving.empty:
+    frames_moving = np.asarray(frames_moving)
+    if frames_moving.size == 0:
         return np.array([]), [], 0.0
 
-    is_instantly_still = (frames_moving < immobility_threshold).astype(int)
-    is_persistently_still = is_instantly_still.rolling(window=window_size, min_periods=window_size).sum() == window_size
-    is_persistently_still = is_persistently_still.shift(-(window_size - 1)).fillna(False)
-    persistent_immobility_bool = is_persistently_still.astype(bool)
-    frame_events = np.where(persistent_immobility_bool.values)[0]
+    persistent_immobility_bool = detect_immobility_array(frames_moving, immobility_threshold, window_size)
+    frame_events = np.flatnonzero(persistent_immobility_bool)
     
     seconds_immobility = len(frame_events) / frame_rate if frame_rate != 0 else 0.0
     
-    return persistent_immobility_bool.values, frame_events, seconds_immobility
+    return persistent_immobility_bool, frame_events, seconds_immobility
+
+
+def detect_immobility_batch(binary_areas_per_subject, immobility_threshold, window_size, frame_rates):
+    """
+    detect_immobility for a whole cohort in one call.
+
+    Args:
+        binary_areas_per_subject: 2-D array with one row per subject, or a list of 1-D series/arrays
+            of possibly different lengths (shorter rows are padded as moving and trimmed again)
+        frame_rates: one frame rate for all subjects or one per subject
+    Returns:
+        persistent_immobility_list: list of boolean arrays, one per subject
+        frame_events_list: list of frame index arrays, one per subject
+        seconds_immobility: np.ndarray of immobility seconds per subject
+    """
+    rows = [np.asarray(areas, dtype=np.float64) for areas in binary_areas_per_subject]
+    if not rows:
+        return [], [], np.array([])
+
+    lengths = [len(row) for row in rows]
+    stacked = np.full((len(rows), max(lengths)), np.inf)
+    for i, row in enumerate(rows):
+        stacked[i, :len(row)] = row
+
+    masks = detect_immobility_array(stacked, immobility_threshold, window_size)
+    persistent_immobility_list = [masks[i, :length] for i, length in enumerate(lengths)]
+    frame_events_list = [np.flatnonzero(mask) for mask in persistent_immobility_list]
+
+    frame_rates = np.broadcast_to(np.asarray(frame_rates, dtype=np.float64), (len(rows),))
+    frame_counts = masks.sum(axis=1)
+    seconds_immobility = np.divide(frame_counts, frame_rates, out=np.zeros(len(rows)), where=frame_rates != 0)
+    return persistent_immobility_list, frame_events_list, seconds_immobility
+
+
+def immobility_bin_edges(n_frames, framerate, time_adjustment=0, num_bins=None, bin_seconds=None, epochs=None):
+    """
+    Frame ranges for one binning scheme. Give exactly one of:
+        num_bins: N equal bins after the time adjustment, plus a remainder bin if the frames do not divide evenly
+        bin_seconds: consecutive bins of this many seconds after the time adjustment (the last one may be shorter)
+        epochs: protocol epochs as (name, start_seconds, end_seconds) tuples or {'name', 'start', 'end'} dicts,
+                with times measured from the time adjustment (e.g. tone/trace/shock intervals)
+    Returns:
+        bin_names: list of column names
+        bin_starts, bin_stops: np.ndarray of frame indices, each bin covering [start, stop) of the recording
+    """
+    if sum(scheme is not None for scheme in (num_bins, bin_seconds, epochs)) != 1:
+        raise ValueError("Give exactly one of num_bins, bin_seconds or epochs")
+
+    offset_frames = int(time_adjustment * framerate) if framerate != 0 else 0
+
+    if num_bins is not None:
+        effective_length = max(0, n_frames - offset_frames)
+        bin_size = effective_length // num_bins
+        bin_starts = np.arange(num_bins) * bin_size + offset_frames
+        bin_stops = bin_starts + bin_size
+        if effective_length % num_bins != 0:
+            remainder_start = num_bins * bin_size + offset_frames
+            if max(0, remainder_start) < n_frames:
+                bin_starts = np.append(bin_starts, remainder_start)
+                bin_stops = np.append(bin_stops, n_frames)
+        bin_names = [f'Bin_{i+1}' for i in range(len(bin_starts))]
+
+    elif bin_seconds is not None:
+        bin_size = max(1, int(round(bin_seconds * framerate)))
+        first_frame = max(0, offset_frames)
+        bin_starts = np.arange(first_frame, max(first_frame, n_frames), bin_size)
+        bin_stops = bin_starts + bin_size
+        bin_names = [f'Bin_{i+1}' for i in range(len(bin_starts))]
+
+    else:
+        bin_names, bin_starts, bin_stops = [], [], []
+        for epoch in epochs:
+            if isinstance(epoch, dict):
+                name, start_seconds, end_seconds = epoch['name'], epoch['start'], epoch['end']
+            else:
+                name, start_seconds, end_seconds = epoch
+            bin_names.append(str(name))
+            bin_starts.append(offset_frames + int(round(start_seconds * framerate)))
+            bin_stops.append(offset_frames + int(round(end_seconds * framerate)))
+
+    bin_starts = np.clip(np.asarray(bin_starts, dtype=np.int64), 0, n_frames)
+    bin_stops = np.clip(np.asarray(bin_stops, dtype=np.int64), bin_starts, n_frames)
+    return bin_names, bin_starts, bin_stops
+
+
+def immobility_bin_counts(persistent_immobility, bin_starts, bin_stops):
+    """
+    Immobile frames in every [start, stop) range, from one cumulative sum indexed at the bin edges.
+    A 1-D mask gives one count per bin; a 2-D mask (one row per subject) gives one row of counts per subject,
+    and the edges may then also be 2-D (one row of edges per subject).
+    """
+    mask = np.asarray(persistent_immobility)
+    immobile_so_far = np.zeros(mask.shape[:-1] + (mask.shape[-1] + 1,), dtype=np.int64)
+    np.cumsum(mask, axis=-1, dtype=np.int64, out=immobile_so_far[..., 1:])
+    return (np.take_along_axis(immobile_so_far, np.broadcast_to(bin_stops, mask.shape[:-1] + np.shape(bin_stops)[-1:]), axis=-1)
+            - np.take_along_axis(immobile_so_far, np.broadcast_to(bin_starts, mask.shape[:-1] + np.shape(bin_starts)[-1:]), axis=-1))
+
+
+def calculate_immobility_by_bins(persistent_immobility, framerate, time_adjustment=0, num_bins=None, bin_seconds=None,
+                                 epochs=None, subject_names=None):
+    """
+    Seconds of immobility per bin for one or many subjects, with any of the schemes of immobility_bin_edges.
+
+    Args:
+        persistent_immobility: one mask, a 2-D array with one row per subject or a list of masks
+            of possibly different lengths
+        framerate: one frame rate for all subjects or one per subject
+        subject_names: index of the returned DataFrame (defaults to 0..n-1)
+    Returns:
+        df_bins: DataFrame with one row per subject and one column per bin; bins a subject does
+                 not have (e.g. a missing remainder bin) are NaN
+    """
+    if isinstance(persistent_immobility, np.ndarray) and persistent_immobility.ndim == 1:
+        persistent_immobility = [persistent_immobility]
+    masks = [np.asarray(mask, dtype=bool).ravel() for mask in persistent_immobility]
+    n_subjects = len(masks)
+    if n_subjects == 0:
+        return pd.DataFrame()
+
+    framerates = np.broadcast_to(np.asarray(framerate, dtype=np.float64), (n_subjects,))
+    edges = [immobility_bin_edges(len(mask), fr, time_adjustment, num_bins, bin_seconds, epochs)
+             for mask, fr in zip(masks, framerates)]
+    bin_names = max((names for names, _, _ in edges), key=len)
+    n_bins = len(bin_names)
+
+    # Pad everything to rectangles: padded frames are never immobile and padded bins are empty
+    stacked = np.zeros((n_subjects, max(len(mask) for mask in masks)), dtype=bool)
+    bin_starts = np.zeros((n_subjects, n_bins), dtype=np.int64)
+    bin_stops = np.zeros((n_subjects, n_bins), dtype=np.int64)
+    has_bin = np.zeros((n_subjects, n_bins), dtype=bool)
+    for i, (mask, (names, starts, stops)) in enumerate(zip(masks, edges)):
+        stacked[i, :len(mask)] = mask
+        bin_starts[i, :len(names)] = starts
+        bin_stops[i, :len(names)] = stops
+        has_bin[i, :len(names)] = True
+
+    counts = immobility_bin_counts(stacked, bin_starts, bin_stops)
+    seconds = np.divide(counts, framerates[:, None], out=np.zeros(counts.shape), where=framerates[:, None] != 0)
+    seconds[~has_bin] = np.nan
+    return pd.DataFrame(seconds, columns=bin_names, index=subject_names)
 
 
 def calculate_immobility_by_bin_core(persistent_immobility, num_bins, framerate, time_adjustment):
     if len(persistent_immobility) == 0:
         return pd.DataFrame()
 
-    immobility_series = pd.Series(persistent_immobility.flatten())
+    immobility_mask = np.asarray(persistent_immobility).flatten()
     
     offset_frames = int(time_adjustment * framerate) if framerate != 0 else 0
-    effective_length = len(immobility_series) - offset_frames
+    effective_length = len(immobility_mask) - offset_frames
     
     if effective_length <= 0:
         return pd.DataFrame([np.zeros(num_bins)], columns=[f'Bin_{i+1}' for i in range(num_bins)])
 
-    bin_size = effective_length // num_bins
-    true_counts = []
-    
-    for i in range(num_bins):
-        start_index = i * bin_size + offset_frames
-        end_index = start_index + bin_size
-        
-        start_index = max(0, min(int(start_index), len(immobility_series)))
-        end_index = max(0, min(int(end_index), len(immobility_series)))
-        
-        if start_index >= end_index:
-            true_counts.append(0)
-        else:
-            bin_slice = immobility_series.iloc[start_index:end_index]
-            true_count = np.sum(bin_slice.values)
-            true_counts.append(true_count)
-    
-    if effective_length % num_bins != 0:
-        remainder_start_index = num_bins * bin_size + offset_frames
-        remainder_start_index = max(0, min(int(remainder_start_index), len(immobility_series)))
-        
-        if remainder_start_index < len(immobility_series):
-            remainder_slice = immobility_series.iloc[remainder_start_index:]
-            true_count_remainder = np.sum(remainder_slice.values)
-            true_counts.append(true_count_remainder)
+    column_names, bin_starts, bin_stops = immobility_bin_edges(len(immobility_mask), framerate, time_adjustment, num_bins=num_bins)
+    true_counts = immobility_bin_counts(immobility_mask, bin_starts, bin_stops)
 
     true_counts_seconds = np.array(true_counts) / framerate if framerate != 0 else np.array(true_counts) * 0.0
     
-    column_names = [f'Bin_{i+1}' for i in range(len(true_counts))]
     df_bins = pd.DataFrame([true_counts_seconds], columns=column_names)
     return df_bins
 
 
-def create_immobility_mark_video(input_video_path, output_video_path, frame_events, frame_progress_callback=None):
+def score_subject(mouse, framerate, binary_area_series, immobility_threshold, window_size, output_folder,
+                  time_adjustment=0, num_bins=None, bin_seconds=None, epochs=None, save_frames=False,
+                  parameters=None):
+    """
+    Everything downstream of background subtraction for one subject: immobility detection, the bout
+    CSV in output_folder and the binned summary (see calculate_immobility_by_bins for the bin options).
+    With save_frames the per-frame binary areas and immobility mask are also written with
+    save_frame_store, with `parameters` (a JSON-serialisable dict) recorded as metadata.
+    Returns:
+        summary: dict with total_immobility and the seconds of immobility of every bin, in column order
+        persistent_immobility: boolean array, one value per frame
+        frame_events: list of immobile frame indices
+        seconds_immobility: float
+    """
+    persistent_immobility, frame_events, seconds_immobility = detect_immobility(
+        binary_area_series, immobility_threshold, window_size, framerate
+    )
+
+    create_csv_immobility(persistent_immobility, mouse, framerate, output_folder)
+    if save_frames:
+        frame_store_parameters = dict(parameters or {})
+        frame_store_parameters.update({'immobility_threshold': immobility_threshold, 'window_size': window_size})
+        save_frame_store(output_folder, mouse, framerate, binary_area_series, persistent_immobility,
+                         frame_store_parameters)
+
+    # Same values as calculate_immobility_by_bins for one subject, without building a DataFrame
+    bin_names, bin_starts, bin_stops = immobility_bin_edges(len(persistent_immobility), framerate, time_adjustment,
+                                                            num_bins, bin_seconds, epochs)
+    bin_counts = immobility_bin_counts(persistent_immobility, bin_starts, bin_stops)
+    bin_seconds_immobile = bin_counts / framerate if framerate != 0 else np.zeros(len(bin_counts))
+    summary = {'total_immobility': seconds_immobility}
+    summary.update(zip(bin_names, bin_seconds_immobile.tolist()))
+    return summary, persistent_immobility, frame_events, seconds_immobility
+
+
+# --- Per-frame result store ---
+
+FRAME_STORE_SUFFIX = "_frames"
+_FRAME_STORE_VERSION = 1
+
+
+def frame_store_path(output_folder, mouse):
+    return Path(output_folder) / f"immobility_{mouse}{FRAME_STORE_SUFFIX}"
+
+
+def save_frame_store(output_folder, mouse, framerate, binary_area_series, persistent_immobility, parameters=None):
+    """
+    Writes the per-frame evidence of one subject to the folder immobility_<mouse>_frames:
+        binary_area.npy         uint32, one value per frame
+        immobility_packed.npy   persistent_immobility as np.packbits bits (1 bit per frame)
+        meta.json               subject, frame count, framerate and the analysis parameters
+    Plain .npy files, so load_frame_store can memory-map them.
+    Returns:
+        path of the store folder
+    """
+    store_path = frame_store_path(output_folder, mouse)
+    os.makedirs(store_path, exist_ok=True)
+    binary_areas = np.asarray(binary_area_series, dtype=np.uint32)
+    mask = np.asarray(persistent_immobility, dtype=bool)
+    np.save(store_path / "binary_area.npy", binary_areas)
+    np.save(store_path / "immobility_packed.npy", np.packbits(mask))
+    meta = {
+        'version': _FRAME_STORE_VERSION,
+        'subject': str(mouse),
+        'n_frames': int(len(mask)),
+        'framerate': float(framerate),
+        'parameters': parameters or {},
+    }
+    # meta.json is written last, so a store without it is incomplete and ignored
+    _write_json_atomic(store_path / "meta.json", meta)
+    return store_path
+
+
+def load_frame_store(store_path, mmap=True):
+    """
+    Returns:
+        dict with 'meta' (meta.json contents), 'framerate', 'binary_area' (uint32 array, memory-mapped
+        when mmap is True) and 'persistent_immobility' (bool array, unpacked), or None if the store
+        is incomplete or unreadable (missing meta.json fields, or arrays that do not match its frame count)
+    """
+    store_path = Path(store_path)
+    try:
+        with open(store_path / "meta.json", 'r') as f:
+            meta = json.load(f)
+        n_frames = int(meta['n_frames'])
+        framerate = float(meta['framerate'])
+        mmap_mode = 'r' if mmap else None
+        binary_area = np.load(store_path / "binary_area.npy", mmap_mode=mmap_mode)
+        immobility_packed = np.load(store_path / "immobility_packed.npy", mmap_mode=mmap_mode)
+        if len(binary_area) != n_frames or immobility_packed.size * 8 < n_frames:
+            raise ValueError(f"arrays do not hold the {n_frames} frames listed in meta.json")
+        persistent_immobility = np.unpackbits(immobility_packed, count=n_frames).view(bool)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Warning: Ignoring unreadable frame store {store_path}: {e}")
+        return None
+    return {
+        'meta': meta,
+        'framerate': framerate,
+        'binary_area': binary_area,
+        'persistent_immobility': persistent_immobility,
+    }
+
+
+def find_frame_stores(folder):
+    """Returns {mouse: store path} for every complete frame store in folder."""
+    stores = {}
+    for store_path in sorted(Path(folder).glob(f"immobility_*{FRAME_STORE_SUFFIX}")):
+        if (store_path / "meta.json").exists():
+            mouse = store_path.name[len("immobility_"):-len(FRAME_STORE_SUFFIX)]
+            stores[mouse] = store_path
+    return stores
+
+
+SUMMARY_EXCEL_NAME = "ALL SUBJECTS RESULTS.xlsx"
+SUMMARY_CSV_NAME = "ALL SUBJECTS RESULTS.csv"
+
+
+class SummaryTable:
+    """
+    Per-subject summary rows (as returned by score_subject). Every row is appended to
+    ALL SUBJECTS RESULTS.csv as soon as it is added, so partial results can be opened while a
+    cohort is running; the CSV is only rewritten when a subject brings a column not seen before
+    (e.g. an extra remainder bin). The DataFrame is built once, in to_frame().
+    """
+
+    def __init__(self, output_folder, stream_csv=True):
+        self.output_folder = output_folder
+        self.csv_path = os.path.join(output_folder, SUMMARY_CSV_NAME) if stream_csv else None
+        self.subjects = []
+        self.rows = []
+        self.columns = []
+        self._csv_columns = None
+        if self.csv_path is not None and os.path.exists(self.csv_path):
+            # A summary left by an earlier run would mix with this one's rows
+            try:
+                os.remove(self.csv_path)
+            except OSError as e:
+                print(f"Warning: Could not remove old {self.csv_path}: {e}")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, subject, summary):
+        self.subjects.append(subject)
+        self.rows.append(summary)
+        new_columns = [column for column in summary if column not in self.columns]
+        self.columns.extend(new_columns)
+        if self.csv_path is not None:
+            try:
+                if new_columns or self._csv_columns is None:
+                    self._rewrite_csv()
+                else:
+                    with open(self.csv_path, 'a', newline='') as f:
+                        csv.writer(f).writerow(self._csv_row(subject, summary))
+            except OSError as e:
+                print(f"Warning: Could not write {self.csv_path}: {e}")
+
+    def _csv_row(self, subject, summary):
+        values = (summary.get(column) for column in self._csv_columns)
+        return [subject] + ['' if value is None or (isinstance(value, float) and math.isnan(value)) else value
+                            for value in values]
+
+    def _rewrite_csv(self):
+        self._csv_columns = list(self.columns)
+        temp_path = self.csv_path + ".tmp"
+        with open(temp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([''] + self._csv_columns)
+            writer.writerows(self._csv_row(subject, summary) for subject, summary in zip(self.subjects, self.rows))
+        os.replace(temp_path, self.csv_path)
+
+    def reorder(self, subjects):
+        """
+        Puts the rows in the order of subjects (e.g. the video selection order, when parallel workers
+        finish out of order) and rewrites the CSV to match; subjects not listed keep their place at the end.
+        """
+        position = {subject: idx for idx, subject in enumerate(subjects)}
+        order = sorted(range(len(self.subjects)), key=lambda idx: position.get(self.subjects[idx], len(position) + idx))
+        if order == list(range(len(self.subjects))):
+            return
+        self.subjects = [self.subjects[idx] for idx in order]
+        self.rows = [self.rows[idx] for idx in order]
+        if self.csv_path is not None and self.rows:
+            try:
+                self._rewrite_csv()
+            except OSError as e:
+                print(f"Warning: Could not write {self.csv_path}: {e}")
+
+    def to_frame(self):
+        """All rows as one DataFrame (index: subject), columns in first-seen order, missing values NaN."""
+        return pd.DataFrame.from_records(self.rows, index=self.subjects, columns=self.columns)
+
+    def write_excel(self):
+        return write_summary_excel(self.to_frame(), self.output_folder)
+
+
+def write_summary_excel(all_results, output_folder):
+    """Writes the per-subject summary rows to ALL SUBJECTS RESULTS.xlsx and returns its path."""
+    final_excel_path = os.path.join(output_folder, SUMMARY_EXCEL_NAME)
+    all_results.to_excel(final_excel_path)
+    return final_excel_path
+
+
+# Frames buffered between the stages of run_frame_pipeline
+FRAME_PIPELINE_QUEUE_SIZE = 8
+
+
+def _queue_put(frame_queue, item, abort):
+    """Puts item on a bounded queue, giving up (False) once abort is set."""
+    while not abort.is_set():
+        try:
+            frame_queue.put(item, timeout=STOP_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _queue_get(frame_queue, abort):
+    """Takes the next item from a queue, or None once abort is set."""
+    while not abort.is_set():
+        try:
+            return frame_queue.get(timeout=STOP_POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return None
+
+
+def run_frame_pipeline(cap, process_frame, write_item=None, stop_event=None, max_frames=None, frame_stride=1,
+                       decode_skipped=False, queue_size=FRAME_PIPELINE_QUEUE_SIZE):
+    """
+    Staged frame loop behind the analysis and the marked videos: a reader thread decodes frames from cap,
+    process_frame runs in the calling thread and write_item, if given, runs in a writer thread. The stages
+    are connected by bounded queues. OpenCV releases the GIL while decoding, converting and encoding, so
+    decoding the next frames overlaps with processing the current one.
+
+    Args:
+        cap: opened cv2.VideoCapture (released by the caller)
+        process_frame: called as process_frame(frame_idx, frame, analysed); the frame buffer is reused for
+            later frames once it returns. A return value other than None is passed on to write_item.
+        write_item: called in the writer thread with each value returned by process_frame, in frame order
+        stop_event: checked by the reader every STOP_CHECK_FRAMES frames
+        max_frames: stop after this many frames
+        frame_stride: only every frame_stride-th frame is decoded and analysed; the others are grabbed, or
+            with decode_skipped=True decoded and passed to process_frame with analysed=False
+        queue_size: frames buffered between two stages
+    Returns:
+        frames_seen: number of frames read or grabbed
+        stopped: True if stop_event ended the loop
+    Raises:
+        the first exception raised by any stage, after the other stages have stopped
+    """
+    frame_stride = max(1, int(frame_stride))
+    # abort stops every stage: set on stop_event or when a stage fails
+    abort = threading.Event()
+    decoded_frames = queue.Queue(queue_size)
+    processed_items = queue.Queue(queue_size)
+    # Buffers handed back by the processing stage, so decoding does not allocate a frame every time
+    free_buffers = queue.Queue()
+    errors = []
+    frames_seen = [0]
+    stopped = [False]
+
+    def read_frames():
+        try:
+            frame_idx = 0
+            while max_frames is None or frame_idx < max_frames:
+                if frame_idx % STOP_CHECK_FRAMES == 0 and _stop_requested(stop_event):
+                    stopped[0] = True
+                    abort.set()
+                    return
+                analysed = frame_idx % frame_stride == 0
+                if analysed or decode_skipped:
+                    try:
+                        buffer = free_buffers.get_nowait()
+                    except queue.Empty:
+                        buffer = None
+                    ret, frame = cap.read(buffer)
+                    if not ret:
+                        break
+                    if not _queue_put(decoded_frames, (frame_idx, frame, analysed), abort):
+                        return
+                elif not cap.grab():
+                    break
+                frame_idx += 1
+                frames_seen[0] = frame_idx
+            _queue_put(decoded_frames, None, abort)
+        except Exception as e:
+            errors.append(e)
+            abort.set()
+
+    def write_items():
+        try:
+            while True:
+                item = _queue_get(processed_items, abort)
+                if item is None:
+                    return
+                write_item(item)
+        except Exception as e:
+            errors.append(e)
+            abort.set()
+
+    threads = [threading.Thread(target=read_frames, daemon=True)]
+    if write_item is not None:
+        threads.append(threading.Thread(target=write_items, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            decoded = _queue_get(decoded_frames, abort)
+            if decoded is None:
+                break
+            frame_idx, frame, analysed = decoded
+            item = process_frame(frame_idx, frame, analysed)
+            free_buffers.put(frame)
+            if item is not None and write_item is not None and not _queue_put(processed_items, item, abort):
+                break
+        if write_item is not None:
+            _queue_put(processed_items, None, abort)
+    except BaseException as e:
+        errors.append(e)
+        abort.set()
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return frames_seen[0], stopped[0]
+
+
+# Marked-video codecs (FourCC) and the container each one is written in
+MARKED_VIDEO_CODECS = {
+    'XVID': '.avi',
+    'MJPG': '.avi',
+    'mp4v': '.mp4',
+    'FFV1': '.avi',
+}
+MARKED_VIDEO_DEFAULT_CODEC = 'XVID'
+MARKED_VIDEO_DEFAULT_DOWNSCALE = 3
+
+
+def _open_marked_video_writer(output_video_path, fps, frame_size, codec=MARKED_VIDEO_DEFAULT_CODEC):
+    """Returns an opened cv2.VideoWriter, or None (with a message) if the codec/container cannot be written."""
+    fourcc = cv2.VideoWriter_fourcc(*codec)
+    out = cv2.VideoWriter(str(output_video_path), fourcc, fps, frame_size)
+    if not out.isOpened():
+        print(f"Error: Could not open output video {output_video_path} (codec {codec})")
+        return None
+    return out
+
+
+def _marked_frame(frame, frame_size, marked):
+    """Resized copy of a source frame, with the red immobility dot if marked."""
+    frame_resized = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA)
+    if marked:
+        cv2.circle(frame_resized, (20, 20), 8, (0, 0, 255), -1)
+    return frame_resized
+
+
+def create_immobility_mark_video(input_video_path, output_video_path, frame_events, frame_progress_callback=None,
+                                 stop_event=None, codec=MARKED_VIDEO_DEFAULT_CODEC,
+                                 downscale=MARKED_VIDEO_DEFAULT_DOWNSCALE, frame_stride=1, max_frames=None):
+    """
+    Writes a reduced-size copy of the video with a red dot on every frame in frame_events.
+    Decoding, marking and encoding overlap in the stages of run_frame_pipeline.
+    stop_event is checked every STOP_CHECK_FRAMES frames; when it is set the partial output file is deleted.
+    Args:
+        codec: FourCC of the output (see MARKED_VIDEO_CODECS for the matching container)
+        downscale: output frames are width // downscale by height // downscale
+        frame_stride: only every frame_stride-th frame is written (at fps / frame_stride, so the
+            duration is unchanged); the others are grabbed without decoding
+        max_frames: only the first max_frames source frames
+    Returns:
+        True if the marked video was written completely, False otherwise
+    """
     cap = cv2.VideoCapture(input_video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
     if not cap.isOpened():
         print(f"Error: Could not open input video {input_video_path}")
-        return
+        return False
 
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    
-    new_width = width // 3
-    new_height = height // 3
-    
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    out = cv2.VideoWriter(output_video_path, fourcc, fps, (new_width, new_height))
-    if not out.isOpened():
-        print(f"Error: Could not open output video {output_video_path}")
+    downscale = max(1, int(downscale))
+    frame_stride = max(1, int(frame_stride))
+    frame_size = (width // downscale, height // downscale)
+
+    out = _open_marked_video_writer(output_video_path, fps / frame_stride, frame_size, codec)
+    if out is None:
         cap.release()
-        return
+        return False
 
     frame_indices_to_plot = set(frame_events)
-    frame_number = 0
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-    
-        frame_resized = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-        
-        if frame_number in frame_indices_to_plot:
-            cv2.circle(frame_resized, (20, 20), 8, (0, 0, 255), -1)
-    
-        out.write(frame_resized)
+    def mark_frame(frame_number, frame, _):
+        frame_resized = _marked_frame(frame, frame_size, frame_number in frame_indices_to_plot)
 
         # Call the progress callback if provided
         if frame_progress_callback is not None:
             frame_progress_callback(frame_number, total_frames)
-        
-        frame_number += 1
+        return frame_resized
 
-    cap.release()
-    out.release()
-    cv2.destroyAllWindows()
+    error = None
+    stopped = False
+    try:
+        _, stopped = run_frame_pipeline(cap, mark_frame, out.write, stop_event=stop_event, max_frames=max_frames,
+                                        frame_stride=frame_stride)
+    except Exception as e:
+        error = e
+    finally:
+        cap.release()
+        out.release()
+
+    if stopped or error is not None:
+        try:
+            os.remove(output_video_path)
+        except OSError:
+            pass
+        if error is not None:
+            print(f"Error: Marked video failed for {input_video_path}: {error}")
+        else:
+            print(f"Marked video cancelled, removed partial file: {output_video_path}")
+        return False
     print(f"Marked video created at: {output_video_path}")
+    return True
+
+
+def benchmark_mark_video_settings(video_path, settings, max_frames=300):
+    """
+    Writes the first max_frames frames of video_path as a marked video with each setting, to pick the
+    fastest codec / size that is still good enough for reviewing bouts. Files go to a temporary folder.
+    Args:
+        settings: list of dicts with any of codec, downscale and frame_stride (create_immobility_mark_video arguments)
+    Returns:
+        list of dicts, one per setting: the setting plus
+            ok: False if the codec could not be written
+            frames_written: number of encoded frames
+            encode_fps: frames per second spent in the encoder alone
+            total_fps: source frames per second for decode + mark + encode
+            file_size_bytes: size of the output
+            mb_per_hour: output size extrapolated to one hour of video
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Error: Could not open input video {video_path}")
+        return []
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="stillcount_benchmark_") as benchmark_folder:
+        for setting_idx, setting in enumerate(settings):
+            codec = setting.get('codec', MARKED_VIDEO_DEFAULT_CODEC)
+            downscale = max(1, int(setting.get('downscale', MARKED_VIDEO_DEFAULT_DOWNSCALE)))
+            frame_stride = max(1, int(setting.get('frame_stride', 1)))
+            result = {'codec': codec, 'downscale': downscale, 'frame_stride': frame_stride, 'ok': False,
+                      'frames_written': 0, 'encode_fps': 0.0, 'total_fps': 0.0, 'file_size_bytes': 0,
+                      'mb_per_hour': 0.0}
+            results.append(result)
+
+            frame_size = (width // downscale, height // downscale)
+            output_video_path = os.path.join(benchmark_folder, f"benchmark_{setting_idx}{MARKED_VIDEO_CODECS.get(codec, '.avi')}")
+            out = _open_marked_video_writer(output_video_path, fps / frame_stride, frame_size, codec)
+            if out is None:
+                continue
+
+            encode_seconds = [0.0]
+
+            def timed_write(frame_resized):
+                encode_start = time.perf_counter()
+                out.write(frame_resized)
+                encode_seconds[0] += time.perf_counter() - encode_start
+
+            cap = cv2.VideoCapture(video_path)
+            start = time.perf_counter()
+            try:
+                # Every other frame marked, so the dot is part of what gets encoded
+                frames_seen, _ = run_frame_pipeline(
+                    cap, lambda frame_idx, frame, _: _marked_frame(frame, frame_size, frame_idx % 2 == 0),
+                    timed_write, max_frames=max_frames, frame_stride=frame_stride
+                )
+            finally:
+                cap.release()
+                out.release()
+            total_seconds = time.perf_counter() - start
+
+            frames_written = math.ceil(frames_seen / frame_stride)
+            file_size_bytes = os.path.getsize(output_video_path)
+            video_seconds = frames_seen / fps if fps else 0
+            result.update({
+                'ok': frames_written > 0,
+                'frames_written': frames_written,
+                'encode_fps': frames_written / encode_seconds[0] if encode_seconds[0] else 0.0,
+                'total_fps': frames_seen / total_seconds if total_seconds else 0.0,
+                'file_size_bytes': file_size_bytes,
+                'mb_per_hour': file_size_bytes / video_seconds * 3600 / 1e6 if video_seconds else 0.0,
+            })
+    return results
+
+
+def create_immobility_mark_videos(jobs, n_videos=None, progress_callback=None, stop_event=None,
+                                  mark_video_options=None, bout_clips=None):
+    """
+    Runs create_immobility_mark_video for several videos at the same time in a thread pool.
+
+    Args:
+        jobs: list of (input_video_path, output_video_path, frame_events) tuples
+        n_videos: number of videos exported at once (defaults to the number of CPUs)
+        progress_callback: called as progress_callback(frames_done, total_frames, videos_done, total_videos),
+            summed over all videos, from the export threads
+        stop_event: threading.Event; once set, videos that have not started are skipped and running ones
+            stop within STOP_CHECK_FRAMES frames (their partial files are deleted)
+        mark_video_options: optional dict of codec, downscale and frame_stride for create_immobility_mark_video
+        bout_clips: optional dict of create_immobility_bout_clips arguments (padding_seconds, highlight_reel);
+            only the bouts are exported and each job's output path is the reel file or the clip folder
+    Returns:
+        results: list of booleans (video written completely) in the same order as jobs
+    """
+    jobs = list(jobs)
+    results = [False] * len(jobs)
+    if not jobs:
+        return results
+    if n_videos is None:
+        n_videos = os.cpu_count() or 1
+    n_videos = max(1, min(int(n_videos), len(jobs)))
+
+    frame_counts = []
+    for input_video_path, _, _ in jobs:
+        cap = cv2.VideoCapture(str(input_video_path))
+        frame_counts.append(max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT))))
+        cap.release()
+    frames_done = [0] * len(jobs)
+    videos_done = [0]
+    progress_lock = threading.Lock()
+
+    def report(job_idx, current_frame, job_total_frames=None):
+        with progress_lock:
+            if current_frame is None:
+                videos_done[0] += 1
+            else:
+                frames_done[job_idx] = current_frame + 1
+                # Bout clips only cover part of the video
+                if job_total_frames is not None:
+                    frame_counts[job_idx] = job_total_frames
+            progress = (sum(frames_done), sum(frame_counts), videos_done[0], len(jobs))
+        if progress_callback is not None:
+            progress_callback(*progress)
+
+    def export(job_idx):
+        if _stop_requested(stop_event):
+            return False
+        input_video_path, output_video_path, frame_events = jobs[job_idx]
+        if bout_clips is not None:
+            written = bool(create_immobility_bout_clips(
+                input_video_path, output_video_path, frame_events,
+                frame_progress_callback=lambda current_frame, clip_frames: report(job_idx, current_frame, clip_frames),
+                stop_event=stop_event, **bout_clips, **(mark_video_options or {})
+            ))
+        else:
+            written = create_immobility_mark_video(
+                input_video_path, output_video_path, frame_events,
+                frame_progress_callback=lambda current_frame, _: report(job_idx, current_frame),
+                stop_event=stop_event, **(mark_video_options or {})
+            )
+        report(job_idx, None)
+        return written
+
+    with ThreadPoolExecutor(max_workers=n_videos) as executor:
+        futures = [executor.submit(export, job_idx) for job_idx in range(len(jobs))]
+        for job_idx, future in enumerate(futures):
+            results[job_idx] = future.result()
+    return results
+
+
+def marked_video_path(video_path, roi_name=None, output_folder=None, codec=MARKED_VIDEO_DEFAULT_CODEC,
+                      suffix="_MARKED"):
+    """
+    Where the marked video of a subject goes: output_folder, or by default a "Marked videos" folder next
+    to the source video, named <video stem>[_<roi name>]<suffix> with the container of the codec
+    (see MARKED_VIDEO_CODECS). The folder is created if needed.
+    """
+    output_folder_marked = Path(output_folder) if output_folder else Path(video_path).parent / "Marked videos"
+    os.makedirs(output_folder_marked, exist_ok=True)
+    roi_suffix = f"_{roi_name}" if roi_name else ""
+    extension = MARKED_VIDEO_CODECS.get(codec, '.avi')
+    return output_folder_marked / (Path(video_path).stem + roi_suffix + suffix + extension)
+
+
+class _ImmobilityMarkWriter:
+    """
+    Writes the same video as create_immobility_mark_video from the frames of the analysis decode pass.
+
+    Whether a frame is marked depends on the window_size - 1 frames after it (see detect_immobility_array),
+    so the resized frames are held back that many frames and written as soon as their window is
+    complete. The last frames are marked from the final series in finish(). codec, downscale and
+    frame_stride are the create_immobility_mark_video options.
+    """
+
+    def __init__(self, output_video_path, fps, immobility_threshold, window_size, codec=MARKED_VIDEO_DEFAULT_CODEC,
+                 downscale=MARKED_VIDEO_DEFAULT_DOWNSCALE, frame_stride=1):
+        self.output_video_path = str(output_video_path)
+        self.fps = fps
+        self.immobility_threshold = immobility_threshold
+        self.window_size = max(1, int(window_size))
+        self.codec = codec
+        self.downscale = max(1, int(downscale))
+        self.frame_stride = max(1, int(frame_stride))
+        self.frame_size = None
+        self.failed = False
+        self._out = None
+        self._pending = deque()  # (source frame resized or None if not written, is still)
+        self._pending_still = 0
+        self._pushed = 0
+        self._released = 0
+
+    def push(self, frame, binary_area):
+        """
+        Adds the next source frame. Returns the oldest held-back frame, marked and ready for write(),
+        once its window is complete (None if there is none or frame_stride leaves it out).
+        """
+        if self.failed:
+            return None
+        if self._out is None:
+            height, width = frame.shape[:2]
+            self.frame_size = (width // self.downscale, height // self.downscale)
+            self._out = _open_marked_video_writer(self.output_video_path, self.fps / self.frame_stride,
+                                                  self.frame_size, self.codec)
+            if self._out is None:
+                self.failed = True
+                return None
+
+        is_still = binary_area < self.immobility_threshold
+        # Frames left out by frame_stride are never resized
+        frame_resized = None
+        if self._pushed % self.frame_stride == 0:
+            frame_resized = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+        self._pending.append((frame_resized, is_still))
+        self._pending_still += is_still
+        self._pushed += 1
+        if len(self._pending) == self.window_size:
+            return self._release_oldest(self._pending_still == self.window_size)
+        return None
+
+    def _release_oldest(self, marked):
+        frame_resized, is_still = self._pending.popleft()
+        self._pending_still -= is_still
+        if marked and frame_resized is not None:
+            cv2.circle(frame_resized, (20, 20), 8, (0, 0, 255), -1)
+        self._released += 1
+        return frame_resized
+
+    def write(self, frame_resized):
+        self._out.write(frame_resized)
+
+    def finish(self, binary_area_series):
+        """
+        Writes the held-back frames, marked from the final binary_area_series, and closes the file.
+        Returns:
+            True if the marked video was written completely, False otherwise
+        """
+        if self.failed or self._out is None:
+            return False
+        persistent_immobility = detect_immobility_array(np.asarray(binary_area_series), self.immobility_threshold,
+                                                        self.window_size)
+        while self._pending:
+            frame_idx = self._released
+            frame_resized = self._release_oldest(frame_idx < len(persistent_immobility) and persistent_immobility[frame_idx])
+            if frame_resized is not None:
+                self.write(frame_resized)
+        self._out.release()
+        print(f"Marked video created at: {self.output_video_path}")
+        return True
+
+    def discard(self):
+        """Closes and deletes the partial file (e.g. when the analysis was stopped)."""
+        self._pending.clear()
+        if self._out is not None:
+            self._out.release()
+            try:
+                os.remove(self.output_video_path)
+            except OSError:
+                pass
+
+    
+def immobility_bouts(persistent_immobility):
+    """
+    Run-length encodes an immobility mask.
+    Returns:
+        starts: np.ndarray with the first frame of every bout
+        stops: np.ndarray with the last frame (inclusive) of every bout
+    """
+    mask = np.asarray(persistent_immobility).ravel()
+    if mask.dtype != bool:
+        mask = mask.astype(int) > 0
+
+    # +1 where a bout begins, -1 on the frame after it ends
+    edges = np.diff(mask.astype(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1) - 1
+    return starts, stops
+
+
+def bouts_to_mask(starts, stops, n_frames=None):
+    """
+    Inverse of immobility_bouts: boolean mask with every frame from starts[i] to stops[i] (inclusive) set.
+    n_frames defaults to the frame after the last stop.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    if n_frames is None:
+        n_frames = int(stops.max()) + 1 if stops.size else 0
+
+    edges = np.zeros(n_frames + 1, dtype=np.int64)
+    np.add.at(edges, np.clip(starts, 0, n_frames), 1)
+    np.add.at(edges, np.clip(stops + 1, 0, n_frames), -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+def padded_bout_ranges(starts, stops, padding_frames=0, n_frames=None):
+    """
+    Frame ranges to export for a set of bouts: every bout widened by padding_frames on both sides,
+    clipped to the video, with overlapping or touching ranges merged.
+    Returns:
+        list of (first_frame, last_frame) tuples (inclusive), in order
+    """
+    padding_frames = max(0, int(padding_frames))
+    ranges = []
+    for start, stop in sorted(zip(np.asarray(starts, dtype=np.int64), np.asarray(stops, dtype=np.int64))):
+        first = max(0, int(start) - padding_frames)
+        last = int(stop) + padding_frames
+        if n_frames is not None:
+            last = min(last, int(n_frames) - 1)
+        if first > last:
+            continue
+        if ranges and first <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], last))
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+# Gaps up to this many frames are decoded through instead of seeking (a seek decodes from the previous keyframe)
+BOUT_SEEK_MIN_GAP_FRAMES = 50
+
+
+def _seek_to_frame(cap, frame_idx, position):
+    """
+    Moves cap from position so that the next read returns frame frame_idx: short gaps are grabbed, longer
+    ones seeked (see _seek_exact), falling back to grabbing from the first frame if the seek cannot be verified.
+    Returns:
+        False if the video ended before frame_idx
+    """
+    if frame_idx < position or frame_idx - position > BOUT_SEEK_MIN_GAP_FRAMES:
+        if _seek_exact(cap, frame_idx):
+            return True
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        position = 0
+    for _ in range(frame_idx - position):
+        if not cap.grab():
+            return False
+    return True
+
+
+def create_immobility_bout_clips(input_video_path, output_path, frame_events, padding_seconds=1.0,
+                                 highlight_reel=True, frame_progress_callback=None, stop_event=None,
+                                 codec=MARKED_VIDEO_DEFAULT_CODEC, downscale=MARKED_VIDEO_DEFAULT_DOWNSCALE,
+                                 frame_stride=1):
+    """
+    Exports only the immobility bouts (immobility_bouts of frame_events, as in create_csv_immobility) with
+    padding_seconds of context on both sides, instead of the whole video. Bouts whose padded ranges
+    overlap are merged. The video is seeked to every range, so the frames in between are not decoded.
+    Frames are marked and sized like create_immobility_mark_video (same codec, downscale and frame_stride).
+
+    Args:
+        output_path: the highlight reel file (highlight_reel=True), or a folder that gets one clip per range
+            named <folder name>_<number>_<first frame>-<last frame>
+        frame_progress_callback: called as frame_progress_callback(clip_frame_number, total_clip_frames)
+        stop_event: checked every STOP_CHECK_FRAMES frames; when it is set the files written so far are deleted
+    Returns:
+        list of written file paths (empty if there were no bouts, or on stop or error)
+    """
+    frame_events = np.asarray(frame_events, dtype=np.int64)
+    if frame_events.size == 0:
+        print(f"No immobility bouts for {input_video_path}, no clips written.")
+        return []
+
+    cap = cv2.VideoCapture(input_video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not cap.isOpened():
+        print(f"Error: Could not open input video {input_video_path}")
+        return []
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    downscale = max(1, int(downscale))
+    frame_stride = max(1, int(frame_stride))
+    frame_size = (width // downscale, height // downscale)
+
+    is_immobile = np.zeros(int(frame_events.max()) + 1, dtype=bool)
+    is_immobile[frame_events] = True
+    starts, stops = immobility_bouts(is_immobile)
+    clip_ranges = padded_bout_ranges(starts, stops, int(round(padding_seconds * fps)), total_frames or None)
+    total_clip_frames = sum(last - first + 1 for first, last in clip_ranges)
+
+    output_path = Path(output_path)
+    extension = MARKED_VIDEO_CODECS.get(codec, '.avi')
+    if highlight_reel:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+    else:
+        output_path.mkdir(parents=True, exist_ok=True)
+
+    written_paths = []
+    out = None
+    clip_frames_done = [0]
+    position = 0
+    failed = False
+    try:
+        for clip_idx, (first, last) in enumerate(clip_ranges):
+            if not _seek_to_frame(cap, first, position):
+                break
+            if out is None:
+                if highlight_reel:
+                    clip_path = output_path
+                else:
+                    clip_path = output_path / f"{output_path.name}_{clip_idx + 1:03d}_{first}-{last}{extension}"
+                out = _open_marked_video_writer(clip_path, fps / frame_stride, frame_size, codec)
+                if out is None:
+                    failed = True
+                    break
+                written_paths.append(clip_path)
+
+            def mark_frame(frame_idx, frame, _, first=first):
+                source_frame = first + frame_idx
+                frame_resized = _marked_frame(frame, frame_size,
+                                              source_frame < len(is_immobile) and is_immobile[source_frame])
+                if frame_progress_callback is not None:
+                    frame_progress_callback(clip_frames_done[0] + frame_idx, total_clip_frames)
+                return frame_resized
+
+            frames_seen, stopped = run_frame_pipeline(cap, mark_frame, out.write, stop_event=stop_event,
+                                                      max_frames=last - first + 1, frame_stride=frame_stride)
+            clip_frames_done[0] += frames_seen
+            position = first + frames_seen
+            if stopped:
+                failed = True
+                break
+            if not highlight_reel:
+                out.release()
+                out = None
+    except Exception as e:
+        print(f"Error: Bout clips failed for {input_video_path}: {e}")
+        failed = True
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+
+    if failed:
+        for clip_path in written_paths:
+            try:
+                os.remove(clip_path)
+            except OSError:
+                pass
+        print(f"Bout clips cancelled or failed, removed partial files for: {input_video_path}")
+        return []
+    print(f"{len(written_paths)} bout clip file(s) with {len(clip_ranges)} bouts created at: {output_path}")
+    return written_paths
 
     
 def create_csv_immobility(persistent_immobility, mouse, framerate, dir_path):
@@ -254,38 +2033,340 @@ def create_csv_immobility(persistent_immobility, mouse, framerate, dir_path):
         print(f"No immobility detected for {mouse}, skipping CSV creation.")
         return
 
-    if persistent_immobility.ndim > 1:
-        persistent_immobility = persistent_immobility.flatten()
-    persistent_immobility = persistent_immobility.astype(int)
+    starts, stops = immobility_bouts(persistent_immobility)
 
-    behav_indices = np.where(persistent_immobility > 0)[0]
-
-    if len(behav_indices) == 0:
+    if len(starts) == 0:
         print(f"No immobility frames found for {mouse}.")
         return
 
-    behavioral_events = []
-    if len(behav_indices) > 0:
-        start = behav_indices[0]
-        for i in range(len(behav_indices) - 1):
-            if behav_indices[i + 1] != behav_indices[i] + 1:
-                behavioral_events.append((start, behav_indices[i]))
-                start = behav_indices[i + 1]
-        behavioral_events.append((start, behav_indices[-1]))
-
-    if not behavioral_events:
-        print(f"Could not form behavioral events for {mouse}.")
-        return
+    # One START row and one STOP row per bout, interleaved
+    image_index = np.empty(2 * len(starts), dtype=np.int64)
+    image_index[0::2] = starts
+    image_index[1::2] = stops
+    times = image_index / framerate if framerate != 0 else np.zeros(len(image_index))
 
-    rows_list = []
-    for start_idx, stop_idx in behavioral_events:
-        rows_list.append({'Behavior': 'immobility', 'Behavior type': 'START', 'Time': start_idx / framerate if framerate !=0 else 0.0, 'Image index': start_idx})
-        rows_list.append({'Behavior': 'immobility', 'Behavior type': 'STOP', 'Time': stop_idx / framerate if framerate !=0 else 0.0, 'Image index': stop_idx})
-    
-    immobility_df = pd.DataFrame(rows_list)
-    immobility_df['Image index'] = immobility_df['Image index'].astype(int)
+    immobility_df = pd.DataFrame({
+        'Behavior': 'immobility',
+        'Behavior type': np.tile(['START', 'STOP'], len(starts)),
+        'Time': times,
+        'Image index': image_index,
+    })
 
 
     csv_output_path = os.path.join(dir_path, f'immobility_{mouse}.csv')
     immobility_df.to_csv(csv_output_path, index=False)
     print(f"immobility CSV created at: {csv_output_path}")
+
+# --- Cohort runs (shared by the GUI and the CLI) ---
+
+# Analysis defaults, under the config keys written by the GUI's save_config
+ANALYSIS_DEFAULTS = {
+    'video_threshold': 130,
+    'immobility_threshold': 50,
+    'frame_interval_bg_sub': 3,
+    'window_size_immobility': 2,
+    'bins': 12,
+    'bin_seconds': 0,
+    'time_adjustment': 0,
+    'n_workers': 1,
+    'split_video_segments': False,
+    'use_motion_cache': True,
+    'analysis_stride': 1,
+    'downscale': 1,
+    'save_frame_store': False,
+    'mark_videos_during_analysis': False,
+    'marked_video_codec': MARKED_VIDEO_DEFAULT_CODEC,
+    'marked_video_downscale': MARKED_VIDEO_DEFAULT_DOWNSCALE,
+    'marked_video_frame_stride': 1,
+    'marked_video_folder': "",
+    'roi_x1': 10,
+    'roi_y1': 10,
+    'roi_x2': 110,
+    'roi_y2': 110,
+}
+
+
+def analysis_params_from_config(config):
+    """
+    Reads the analysis parameters from a config dict (the schema written by the GUI's save_config and
+    used by Resources/analysis configuration files), with ANALYSIS_DEFAULTS for missing keys.
+    Raises:
+        ValueError: if the ROI is empty and no named ROIs are given
+    """
+    config = dict(ANALYSIS_DEFAULTS, **config)
+    x1, y1 = int(config['roi_x1']), int(config['roi_y1'])
+    x2, y2 = int(config['roi_x2']), int(config['roi_y2'])
+    roi = (min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1))
+    named_rois = {
+        named_roi['name']: (int(named_roi['x1']), int(named_roi['y1']),
+                            int(named_roi['x2']) - int(named_roi['x1']), int(named_roi['y2']) - int(named_roi['y1']))
+        for named_roi in config.get('named_rois') or []
+    }
+    if (roi[2] <= 0 or roi[3] <= 0) and not named_rois:
+        raise ValueError("Invalid ROI dimensions (width or height is zero).")
+
+    if config.get('epochs'):
+        bin_scheme = {'epochs': config['epochs']}
+    elif int(config['bin_seconds']) > 0:
+        bin_scheme = {'bin_seconds': int(config['bin_seconds'])}
+    else:
+        bin_scheme = {'num_bins': int(config['bins'])}
+
+    return {
+        'roi': roi,
+        'named_rois': named_rois,
+        'video_threshold': float(config['video_threshold']),
+        'immobility_threshold': float(config['immobility_threshold']),
+        'frame_interval': int(config['frame_interval_bg_sub']),
+        'window_size': int(config['window_size_immobility']),
+        'bin_scheme': bin_scheme,
+        'time_adjustment': int(config['time_adjustment']),
+        'n_workers': max(1, int(config['n_workers'])),
+        'split_video_segments': bool(config['split_video_segments']),
+        'use_cache': bool(config['use_motion_cache']),
+        'analysis_stride': max(1, int(config['analysis_stride'])),
+        'downscale': max(1, int(config['downscale'])),
+        'save_frame_store': bool(config['save_frame_store']),
+        'mark_videos': bool(config['mark_videos_during_analysis']),
+        'mark_video_options': {
+            'codec': str(config['marked_video_codec']),
+            'downscale': max(1, int(config['marked_video_downscale'])),
+            'frame_stride': max(1, int(config['marked_video_frame_stride'])),
+        },
+        'mark_video_folder': config['marked_video_folder'] or None,
+    }
+
+
+def video_subject(video_path):
+    """Subject name of a video: the part of the file name before the first '-'."""
+    return Path(video_path).stem.split('-')[0]
+
+
+def score_cohort_subject(subject, framerate, binary_area_series, params, output_folder, motion_params=None,
+                         video_path=None, roi_name=None):
+    """
+    score_subject with the scoring parameters of params (as returned by analysis_params_from_config).
+    video_path / roi_name are recorded in the frame store's meta.json, so marked videos can be exported
+    after loading it.
+    Returns:
+        dict with 'summary', 'persistent_immobility', 'frame_events', 'seconds_immobility',
+        'binary_area_series', 'framerate', 'motion_params', 'video_path' and 'roi_name'
+    """
+    summary, persistent_immobility, frame_events, seconds_immobility = score_subject(
+        subject, framerate, binary_area_series, params['immobility_threshold'], params['window_size'],
+        output_folder, params['time_adjustment'], save_frames=params['save_frame_store'],
+        parameters=dict(motion_params or {}, bin_scheme=params['bin_scheme'], time_adjustment=params['time_adjustment'],
+                        video_path=video_path, roi_name=roi_name),
+        **params['bin_scheme']
+    )
+    return {
+        'summary': summary,
+        'persistent_immobility': persistent_immobility,
+        'frame_events': frame_events,
+        'seconds_immobility': seconds_immobility,
+        'binary_area_series': binary_area_series,
+        'framerate': framerate,
+        'motion_params': motion_params,
+        'video_path': video_path,
+        'roi_name': roi_name,
+    }
+
+
+def run_cohort(video_paths, params, output_folder, stop_event=None, frame_progress_callback=None,
+               segment_progress_callback=None, video_start_callback=None, video_analysed_callback=None,
+               subject_done_callback=None, subject_failed_callback=None, resume_callback=None,
+               frame_display_callback=None, preview_ready=None):
+    """
+    Analyses and scores a cohort of videos: the pipeline behind the GUI's analysis and the CLI.
+    Videos checkpointed in output_folder's run manifest by an earlier run with the same motion parameters
+    are re-scored without decoding; the others run in parallel worker processes (n_workers > 1), split
+    into parallel segments (split_video_segments), with all named ROIs in one pass, or one after another.
+    Every video is checkpointed and scored as soon as its motion is known.
+
+    Args:
+        video_paths: videos in the order their subjects appear in the summary
+        params: analysis parameters as returned by analysis_params_from_config
+        stop_event: threading.Event; once set, running videos are abandoned and nothing more is scored
+        frame_progress_callback: called as (video_path, current_frame, total_frames) for videos analysed
+            in this process
+        segment_progress_callback: called as (video_path, completed_segments, total_segments) for split videos
+        video_start_callback: called as (video_path, index, total) before a video is re-scored from its
+            checkpoint or analysed in this process (index counts from 1 in video_paths)
+        video_analysed_callback: called as (video_path, completed, total) every time a parallel worker finishes
+        subject_done_callback: called as (subject, result) once a subject is scored (result as returned by
+            score_cohort_subject, plus 'resumed', 'index' and 'total')
+        subject_failed_callback: called as (video_path, subject, message) for subjects without motion data
+        resume_callback: called as (resumed_videos, total_videos) when videos are resumed from checkpoints
+        frame_display_callback, preview_ready: live preview (see run_background_subtraction_for_analysis)
+    Returns:
+        summary_table: SummaryTable with the subjects in video_paths order (write_excel is left to the caller)
+        results: {subject: result} in the same order
+        failed_videos: videos with a subject that produced no motion data
+    """
+    video_paths = list(video_paths)
+    total_videos = len(video_paths)
+    named_rois = params['named_rois']
+    n_workers = params['n_workers']
+    split_video_segments = params['split_video_segments'] and n_workers > 1 and not named_rois
+    roi_x, roi_y, roi_width, roi_height = params['roi']
+    common = dict(use_cache=params['use_cache'], analysis_stride=params['analysis_stride'],
+                  downscale=params['downscale'])
+    # The marked videos are written while the videos are decoded for the analysis
+    mark_params = (params['immobility_threshold'], params['window_size']) if params['mark_videos'] else None
+    mark_video_options = params['mark_video_options']
+
+    # Recorded with every checkpoint: the marks depend on the immobility parameters, which resumed videos
+    # may be re-scored with, so a resumed video is re-marked when these differ or its marked file is gone
+    mark_record = None
+    if mark_params:
+        mark_record = json.loads(json.dumps({'mark_params': mark_params, 'mark_video_options': mark_video_options,
+                                             'mark_video_folder': params['mark_video_folder']}))
+
+    def mark_video_path(video_path, roi_name=None):
+        return marked_video_path(video_path, roi_name, params['mark_video_folder'], mark_video_options['codec'])
+
+    def marks_out_of_date(video_path, subjects):
+        entry = run_manifest['videos'].get(os.path.abspath(video_path), {})
+        return (entry.get('marked') != mark_record
+                or any(not Path(mark_video_path(video_path, roi_name)).exists() for roi_name, _ in subjects.values()))
+
+    def stopped():
+        return stop_event is not None and stop_event.is_set()
+
+    # The run manifest in the output folder checkpoints every finished video, so re-running with
+    # the same ROI and motion parameters after a crash or stop skips the videos already done.
+    motion_params = {
+        'roi': list(params['roi']), 'named_rois': named_rois,
+        'video_threshold': params['video_threshold'], 'frame_interval': params['frame_interval'],
+        'analysis_stride': params['analysis_stride'], 'downscale': params['downscale'],
+    }
+    scoring_params = {
+        'immobility_threshold': params['immobility_threshold'], 'window_size': params['window_size'],
+        'bin_scheme': params['bin_scheme'], 'time_adjustment': params['time_adjustment'],
+    }
+    run_manifest = load_run_manifest(output_folder, motion_params, scoring_params, video_paths)
+    resumed_videos = {}
+    for video_path in video_paths:
+        completed_video = load_completed_video(output_folder, run_manifest, video_path)
+        if completed_video is not None:
+            resumed_videos[video_path] = completed_video
+    videos_to_analyse = [video_path for video_path in video_paths if video_path not in resumed_videos]
+    if resumed_videos:
+        print(f"Resuming run: {len(resumed_videos)} of {total_videos} videos already done in {output_folder}")
+        if resume_callback:
+            resume_callback(len(resumed_videos), total_videos)
+
+    summary_table = SummaryTable(output_folder)
+    results = {}
+    failed_videos = []
+    video_index = {video_path: video_idx + 1 for video_idx, video_path in enumerate(video_paths)}
+
+    def score_video(video_path, framerate, subjects):
+        resumed = video_path in resumed_videos
+        # Segment workers cannot share one video writer, so split videos are marked after scoring
+        mark_after_scoring = bool(mark_params) and (marks_out_of_date(video_path, subjects) if resumed
+                                                     else split_video_segments)
+        if mark_after_scoring and resumed:
+            print(f"Marked video of {video_path} is out of date or missing; re-marking it with the current parameters.")
+        for subject, (roi_name, subject_series) in subjects.items():
+            if subject_series.empty:
+                failed_videos.append(video_path)
+                if subject_failed_callback:
+                    subject_failed_callback(video_path, subject, "Could not get binary area data")
+                continue
+            result = score_cohort_subject(subject, framerate, subject_series, params, output_folder,
+                                          motion_params, video_path=video_path, roi_name=roi_name)
+            result.update(resumed=resumed, index=video_index[video_path], total=total_videos)
+            summary_table.add(subject, result['summary'])
+            results[subject] = result
+            if mark_after_scoring:
+                create_immobility_mark_video(video_path, mark_video_path(video_path, roi_name), result['frame_events'],
+                                             stop_event=stop_event, **mark_video_options)
+            if subject_done_callback:
+                subject_done_callback(subject, result)
+        if mark_after_scoring and resumed and not stopped():
+            run_manifest['videos'][os.path.abspath(video_path)]['marked'] = mark_record
+            save_run_manifest(output_folder, run_manifest)
+
+    def finish_analysed_video(video_path, framerate, binary_area_series):
+        # Checkpointed and scored as soon as the motion is known, also while parallel workers are running
+        if stopped():
+            return
+        mouse = video_subject(video_path)
+        # With named ROIs every chamber is scored as its own subject
+        if named_rois:
+            subjects = {f"{mouse}_{roi_name}": (roi_name, series) for roi_name, series in binary_area_series.items()}
+        else:
+            subjects = {mouse: (None, binary_area_series)}
+        if all(not series.empty for _, series in subjects.values()):
+            record_completed_video(output_folder, run_manifest, video_path, framerate, subjects, marked=mark_record)
+        score_video(video_path, framerate, subjects)
+
+    def video_progress(callback, video_path):
+        if callback is None:
+            return None
+        return lambda completed, total: callback(video_path, completed, total)
+
+    for video_path in video_paths:
+        if video_path in resumed_videos:
+            if video_start_callback:
+                video_start_callback(video_path, video_index[video_path], total_videos)
+            score_video(video_path, *resumed_videos[video_path])
+
+    if n_workers > 1 and len(videos_to_analyse) > 1 and not split_video_segments:
+        run_background_subtraction_batch(
+            videos_to_analyse, roi_x, roi_y, roi_width, roi_height, params['video_threshold'], params['frame_interval'],
+            n_workers=n_workers,
+            progress_callback=video_analysed_callback,
+            stop_event=stop_event,
+            rois=named_rois or None,
+            mark_params=mark_params,
+            mark_video_options=mark_video_options,
+            mark_video_folder=params['mark_video_folder'],
+            result_callback=lambda video_path, result: finish_analysed_video(video_path, *result),
+            **common
+        )
+        videos_to_analyse = []
+
+    for video_path in videos_to_analyse:
+        if stopped():
+            break
+        if video_start_callback:
+            video_start_callback(video_path, video_index[video_path], total_videos)
+
+        if named_rois:
+            framerate, binary_area_series = run_background_subtraction_multi_roi(
+                video_path, named_rois, params['video_threshold'], params['frame_interval'],
+                progress_callback=video_progress(frame_progress_callback, video_path),
+                frame_display_callback=frame_display_callback, preview_ready=preview_ready, stop_event=stop_event,
+                mark_video_paths={roi_name: mark_video_path(video_path, roi_name)
+                                  for roi_name in named_rois} if mark_params else None,
+                mark_params=mark_params, mark_video_options=mark_video_options, **common
+            )
+        elif split_video_segments:
+            framerate, binary_area_series = run_background_subtraction_segmented(
+                video_path, roi_x, roi_y, roi_width, roi_height, params['video_threshold'], params['frame_interval'],
+                n_workers=n_workers, progress_callback=video_progress(segment_progress_callback, video_path),
+                stop_event=stop_event, **common
+            )
+        else:
+            framerate, binary_area_series = run_background_subtraction_for_analysis(
+                video_path, roi_x, roi_y, roi_width, roi_height, params['video_threshold'], params['frame_interval'],
+                progress_callback=video_progress(frame_progress_callback, video_path),
+                frame_display_callback=frame_display_callback, preview_ready=preview_ready, stop_event=stop_event,
+                mark_video_path=mark_video_path(video_path) if mark_params else None,
+                mark_params=mark_params, mark_video_options=mark_video_options, **common
+            )
+
+        if stopped():
+            break
+        finish_analysed_video(video_path, framerate, binary_area_series)
+
+    # Selection order in the Excel and the CSV, whatever order the videos finished in
+    subject_order = []
+    for video_path in video_paths:
+        mouse = video_subject(video_path)
+        subject_order.extend([f"{mouse}_{roi_name}" for roi_name in named_rois] if named_rois else [mouse])
+    summary_table.reorder(subject_order)
+    results = {subject: results[subject] for subject in subject_order if subject in results}
+    return summary_table, results, failed_videos
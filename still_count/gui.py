@@ -11,25 +11,104 @@ import numpy as np
 from PIL import Image, ImageTk
 import pandas as pd
 from pathlib import Path
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import os
 import json
 import random
-from collections import deque
 import threading
 import time
 import tkinter.font as tkFont
-from datetime import datetime
-import requests
+import urllib.request
+from io import BytesIO
 
 
-from .core import take_all_files, run_background_subtraction_for_analysis, detect_immobility, calculate_immobility_by_bin_core, create_immobility_mark_video,create_csv_immobility
+from .core import take_all_files, create_immobility_mark_videos, marked_video_path, benchmark_mark_video_settings, MARKED_VIDEO_CODECS, bouts_to_mask, compare_downscale_agreement, SummaryTable, find_frame_stores, load_frame_store, ANALYSIS_DEFAULTS, analysis_params_from_config, video_subject, score_cohort_subject, run_cohort
+
+
+LOGO_PATH = Path(__file__).resolve().parent.parent / "Still_count_logo.png"
+LOGO_URL = "https://github.com/paulagsotres/Still_Count/blob/master/Still_count_logo.png?raw=true"
+LOGO_CACHE_DIR = Path.home() / ".stillcount_cache"
+LOGO_WIDTH = 280
+LOGO_FETCH_TIMEOUT = 3  # seconds
+
+
+def _resize_logo(original_logo, target_width=LOGO_WIDTH):
+    # Fixed width, height scaled proportionally
+    img_ratio = original_logo.width / original_logo.height
+    target_height = int(target_width / img_ratio)
+    return original_logo.resize((target_width, target_height), Image.LANCZOS)
+
+
+def _cache_logo(img_resized, cached_path):
+    try:
+        LOGO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        img_resized.save(cached_path)
+    except OSError as e:
+        print(f"Could not cache resized logo: {e}")
+
+
+def load_logo_image(target_width=LOGO_WIDTH):
+    """
+    Returns the resized logo as a PIL image from the cached copy (or from the bundled PNG, caching the
+    resized copy on the way), or None if neither exists. Never touches the network.
+    """
+    cached_path = LOGO_CACHE_DIR / f"logo_{target_width}.png"
+    try:
+        if cached_path.exists() and (not LOGO_PATH.exists() or cached_path.stat().st_mtime >= LOGO_PATH.stat().st_mtime):
+            return Image.open(cached_path)
+        if LOGO_PATH.exists():
+            img_resized = _resize_logo(Image.open(LOGO_PATH), target_width)
+            _cache_logo(img_resized, cached_path)
+            return img_resized
+    except OSError as e:
+        print(f"Could not load logo image: {e}")
+    return None
+
+
+def fetch_logo_image(target_width=LOGO_WIDTH, timeout=LOGO_FETCH_TIMEOUT):
+    """Downloads and resizes the logo (caching it like load_logo_image); meant for a background thread."""
+    with urllib.request.urlopen(LOGO_URL, timeout=timeout) as response:
+        original_logo = Image.open(BytesIO(response.read()))
+        original_logo.load()
+    img_resized = _resize_logo(original_logo, target_width)
+    _cache_logo(img_resized, LOGO_CACHE_DIR / f"logo_{target_width}.png")
+    return img_resized
+
+
+UI_POLL_INTERVAL_MS = 50
+
+
+class LatestValueChannel:
+    """
+    Thread-safe mailbox from the analysis thread to the Tk loop. put() overwrites the pending value
+    for its key, so however fast the worker reports, the UI only handles the latest progress, status
+    and preview frame at each poll.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def put(self, key, value):
+        with self._lock:
+            self._pending[key] = value
+
+    def has_pending(self, key):
+        with self._lock:
+            return key in self._pending
+
+    def drain(self):
+        """Returns and clears all pending values."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
 
 
 class immobilityAnalyzerGUI:
-    def __init__(self, master):
+    def __init__(self, master, startup_started=None):
         self.master = master
+        # perf_counter() value the startup time is measured from (e.g. taken before the imports in run_gui.py)
+        self._startup_started = time.perf_counter() if startup_started is None else startup_started
+        self._time_to_first_window = None
         master.title("StillCount: Behavioral Immobility Analyzer")
         
          # Hardcoded preconfigured full analysis configs
@@ -90,24 +169,49 @@ class immobilityAnalyzerGUI:
             },
         }
 
+        # Marked video export modes -> highlight_reel argument of create_immobility_bout_clips (None = full video)
+        self.MARKED_VIDEO_EXPORT_MODES = {
+            "Full video": None,
+            "Highlight reel": True,
+            "Bout clips": False,
+        }
+
         self.video_files = {}
         self.current_folder_path = ""
         self.config_file = "immobility_analysis_config.json"
 
         # Thresholds
-        self.video_threshold = tk.IntVar(value=130)
-        self.immobility_threshold = tk.IntVar(value=50)
-
-        self.frame_interval_bg_sub = tk.IntVar(value=3)
-        self.window_size_immobility = tk.IntVar(value=2)
-        self.bins = tk.IntVar(value=12)
-        self.time_adjustment = tk.IntVar(value=0)
+        self.video_threshold = tk.IntVar(value=ANALYSIS_DEFAULTS['video_threshold'])
+        self.immobility_threshold = tk.IntVar(value=ANALYSIS_DEFAULTS['immobility_threshold'])
+
+        self.frame_interval_bg_sub = tk.IntVar(value=ANALYSIS_DEFAULTS['frame_interval_bg_sub'])
+        self.window_size_immobility = tk.IntVar(value=ANALYSIS_DEFAULTS['window_size_immobility'])
+        self.bins = tk.IntVar(value=ANALYSIS_DEFAULTS['bins'])
+        self.bin_seconds = tk.IntVar(value=ANALYSIS_DEFAULTS['bin_seconds'])
+        self.epochs = []
+        self.time_adjustment = tk.IntVar(value=ANALYSIS_DEFAULTS['time_adjustment'])
+        self.n_workers = tk.IntVar(value=ANALYSIS_DEFAULTS['n_workers'])
+        self.split_video_segments = tk.BooleanVar(value=ANALYSIS_DEFAULTS['split_video_segments'])
+        self.use_motion_cache = tk.BooleanVar(value=ANALYSIS_DEFAULTS['use_motion_cache'])
+        self.analysis_stride = tk.IntVar(value=ANALYSIS_DEFAULTS['analysis_stride'])
+        self.downscale = tk.IntVar(value=ANALYSIS_DEFAULTS['downscale'])
+        self.save_frame_store = tk.BooleanVar(value=ANALYSIS_DEFAULTS['save_frame_store'])
+        self.mark_videos_during_analysis = tk.BooleanVar(value=ANALYSIS_DEFAULTS['mark_videos_during_analysis'])
+        self.marked_video_codec = tk.StringVar(value=ANALYSIS_DEFAULTS['marked_video_codec'])
+        self.marked_video_downscale = tk.IntVar(value=ANALYSIS_DEFAULTS['marked_video_downscale'])
+        self.marked_video_frame_stride = tk.IntVar(value=ANALYSIS_DEFAULTS['marked_video_frame_stride'])
+        self.marked_video_folder = tk.StringVar(value=ANALYSIS_DEFAULTS['marked_video_folder'])
+        self.marked_video_export_mode = tk.StringVar(value="Full video")
+        self.bout_padding_seconds = tk.DoubleVar(value=1.0)
 
         # ROI variables
-        self.roi_x1 = tk.IntVar(value=10)
-        self.roi_y1 = tk.IntVar(value=10)
-        self.roi_x2 = tk.IntVar(value=110)
-        self.roi_y2 = tk.IntVar(value=110)
+        self.roi_x1 = tk.IntVar(value=ANALYSIS_DEFAULTS['roi_x1'])
+        self.roi_y1 = tk.IntVar(value=ANALYSIS_DEFAULTS['roi_y1'])
+        self.roi_x2 = tk.IntVar(value=ANALYSIS_DEFAULTS['roi_x2'])
+        self.roi_y2 = tk.IntVar(value=ANALYSIS_DEFAULTS['roi_y2'])
+        # Named ROIs (one per chamber) analysed in a single pass; each entry is {'name', 'x1', 'y1', 'x2', 'y2'}
+        self.named_rois = []
+        self.add_rois_on_draw = tk.BooleanVar(value=False)
 
         self.preview_frame = None
         self.roi_rect_id = None
@@ -121,6 +225,7 @@ class immobilityAnalyzerGUI:
 
         self.analysis_thread = None
         self.stop_analysis_event = threading.Event()
+        self.ui_channel = LatestValueChannel()
 
         # Classification related attributes
         self.file_listbox_files = {}
@@ -134,9 +239,30 @@ class immobilityAnalyzerGUI:
 
         self.create_widgets()
         self.load_config()
+        self.master.bind("<Map>", self._report_time_to_first_window, add="+")
         self.master.after(100, self.load_random_frame_on_startup)
 
 
+    def _show_logo(self, logo_img):
+        logo_image = ImageTk.PhotoImage(logo_img)
+        self.logo_label.config(image=logo_image, text="")
+        self.logo_label.image = logo_image  # keep reference
+
+    def _fetch_logo_in_background(self):
+        try:
+            logo_img = fetch_logo_image()
+        except Exception as e:
+            print(f"Could not load logo image: {e}")
+            return
+        # PhotoImage has to be created on the Tk thread
+        self.master.after(0, lambda: self._show_logo(logo_img))
+
+    def _report_time_to_first_window(self, event=None):
+        if self._time_to_first_window is not None or event is not None and event.widget is not self.master:
+            return
+        self._time_to_first_window = time.perf_counter() - self._startup_started
+        print(f"Time to first window: {self._time_to_first_window:.3f} s")
+
     def create_widgets(self):
         s = ttk.Style()
         s.theme_use('clam')
@@ -169,35 +295,15 @@ class immobilityAnalyzerGUI:
         left_panel_frame.rowconfigure(0, weight=1)
         left_panel_frame.columnconfigure(0, weight=1)
     
-        try:
-            import requests
-            from io import BytesIO
-        
-            logo_url = "https://github.com/paulagsotres/Still_Count/blob/master/Still_count_logo.png?raw=true"
-            response = requests.get(logo_url)
-            response.raise_for_status()
-        
-            img_data = BytesIO(response.content)
-            original_logo = Image.open(img_data)
-        
-            # Resize manually: fixed width = 120, height scaled proportionally
-            target_width = 280
-            img_ratio = original_logo.width / original_logo.height
-            target_height = int(target_width / img_ratio)
-            img_resized = original_logo.resize((target_width, target_height), Image.LANCZOS)
-        
-            logo_image = ImageTk.PhotoImage(img_resized)
-        
-            # Center the logo in the column
-            logo_label = ttk.Label(logo_frame, image=logo_image)
-            logo_label.image = logo_image  # keep reference
-            logo_label.pack(padx=0, pady=0, expand=False)  # expand=False prevents stretching
-            logo_label.pack(anchor="center")  # center horizontally
-        
-        except Exception as e:
-            print(f"Could not load logo image: {e}")
-            logo_label = ttk.Label(logo_frame, text="Error loading logo", foreground="red")
-            logo_label.pack(fill="both", expand=True)
+        # The logo comes from the bundled PNG (resized copy cached in the user's home), so startup
+        # never waits on the network; only if the PNG is missing is it fetched in the background.
+        self.logo_label = ttk.Label(logo_frame, text="Still Count", font=("Segoe UI", 18, "bold"))
+        self.logo_label.pack(anchor="center")
+        logo_img = load_logo_image()
+        if logo_img is not None:
+            self._show_logo(logo_img)
+        else:
+            threading.Thread(target=self._fetch_logo_in_background, daemon=True).start()
     
       
         # The following row configurations are re-ordered and adjusted to
@@ -206,6 +312,7 @@ class immobilityAnalyzerGUI:
         left_panel_frame.rowconfigure(1, weight=0)  # For the old config_frame
         left_panel_frame.rowconfigure(2, weight=0)  # For the old video_output_frame
         left_panel_frame.rowconfigure(3, weight=1)  # For the old params_frame, which should expand
+        left_panel_frame.rowconfigure(4, weight=0)  # For the marked video export settings
         left_panel_frame.columnconfigure(0, weight=1)
         
         # --- END NEW CODE ---
@@ -273,17 +380,76 @@ class immobilityAnalyzerGUI:
         ttk.Scale(params_frame, from_=1, to=30, orient="horizontal", variable=self.bins).grid(row=4, column=1, padx=5, pady=2, sticky="ew")
         ttk.Entry(params_frame, textvariable=self.bins, width=5).grid(row=4, column=2, padx=5, pady=2)
 
-        ttk.Label(params_frame, text="Time Adjustment (seconds):").grid(row=5, column=0, padx=5, pady=2, sticky="w")
-        ttk.Scale(params_frame, from_=0, to=60, orient="horizontal", variable=self.time_adjustment).grid(row=5, column=1, padx=5, pady=2, sticky="ew")
-        ttk.Entry(params_frame, textvariable=self.time_adjustment, width=5).grid(row=5, column=2, padx=5, pady=2)
+        ttk.Label(params_frame, text="Bin Length (seconds, 0 = use Time Bins):").grid(row=5, column=0, padx=5, pady=2, sticky="w")
+        ttk.Scale(params_frame, from_=0, to=600, orient="horizontal", variable=self.bin_seconds).grid(row=5, column=1, padx=5, pady=2, sticky="ew")
+        ttk.Entry(params_frame, textvariable=self.bin_seconds, width=5).grid(row=5, column=2, padx=5, pady=2)
+
+        ttk.Label(params_frame, text="Time Adjustment (seconds):").grid(row=6, column=0, padx=5, pady=2, sticky="w")
+        ttk.Scale(params_frame, from_=0, to=60, orient="horizontal", variable=self.time_adjustment).grid(row=6, column=1, padx=5, pady=2, sticky="ew")
+        ttk.Entry(params_frame, textvariable=self.time_adjustment, width=5).grid(row=6, column=2, padx=5, pady=2)
         
-        ttk.Label(params_frame, text="Generate binary area plots for videos:").grid(row=6, column=0, padx=5, pady=2, sticky="w")
+        ttk.Label(params_frame, text="Generate binary area plots for videos:").grid(row=7, column=0, padx=5, pady=2, sticky="w")
 
         self.plot_binary_area_var = tk.BooleanVar(value=False)
         self.plot_binary_area_checkbox = ttk.Checkbutton(params_frame,variable=self.plot_binary_area_var)
-        self.plot_binary_area_checkbox.grid(row=6, column=2, padx=5, pady=5, sticky="w")
+        self.plot_binary_area_checkbox.grid(row=7, column=2, padx=5, pady=5, sticky="w")
+
+        ttk.Label(params_frame, text="Parallel Workers (videos at once):").grid(row=8, column=0, padx=5, pady=2, sticky="w")
+        ttk.Scale(params_frame, from_=1, to=max(1, os.cpu_count() or 1), orient="horizontal", variable=self.n_workers).grid(row=8, column=1, padx=5, pady=2, sticky="ew")
+        ttk.Entry(params_frame, textvariable=self.n_workers, width=5).grid(row=8, column=2, padx=5, pady=2)
         
-        ttk.Button(params_frame, text="Help", command=self.show_help_window).grid(row=7, column=0, columnspan=3, pady=10, sticky="ew")
+        ttk.Label(params_frame, text="Split each video across workers:").grid(row=9, column=0, padx=5, pady=2, sticky="w")
+        ttk.Checkbutton(params_frame, variable=self.split_video_segments).grid(row=9, column=2, padx=5, pady=5, sticky="w")
+
+        ttk.Label(params_frame, text="Reuse cached motion (binary areas):").grid(row=10, column=0, padx=5, pady=2, sticky="w")
+        ttk.Checkbutton(params_frame, variable=self.use_motion_cache).grid(row=10, column=2, padx=5, pady=5, sticky="w")
+
+        ttk.Label(params_frame, text="Analysis Stride (analyse every Nth frame):").grid(row=11, column=0, padx=5, pady=2, sticky="w")
+        ttk.Scale(params_frame, from_=1, to=10, orient="horizontal", variable=self.analysis_stride).grid(row=11, column=1, padx=5, pady=2, sticky="ew")
+        ttk.Entry(params_frame, textvariable=self.analysis_stride, width=5).grid(row=11, column=2, padx=5, pady=2)
+
+        ttk.Label(params_frame, text="Downscale Factor (1 = full resolution):").grid(row=12, column=0, padx=5, pady=2, sticky="w")
+        ttk.Scale(params_frame, from_=1, to=8, orient="horizontal", variable=self.downscale).grid(row=12, column=1, padx=5, pady=2, sticky="ew")
+        ttk.Entry(params_frame, textvariable=self.downscale, width=5).grid(row=12, column=2, padx=5, pady=2)
+
+        self.test_downscale_button = ttk.Button(params_frame, text="Test Downscale on Sample Video", command=self.start_downscale_test_thread)
+        self.test_downscale_button.grid(row=13, column=0, columnspan=3, pady=2, sticky="ew")
+
+        ttk.Label(params_frame, text="Save per-frame data (binary area & immobility):").grid(row=14, column=0, padx=5, pady=2, sticky="w")
+        ttk.Checkbutton(params_frame, variable=self.save_frame_store).grid(row=14, column=2, padx=5, pady=5, sticky="w")
+
+        ttk.Label(params_frame, text="Write marked videos during analysis:").grid(row=15, column=0, padx=5, pady=2, sticky="w")
+        ttk.Checkbutton(params_frame, variable=self.mark_videos_during_analysis).grid(row=15, column=2, padx=5, pady=5, sticky="w")
+
+        ttk.Button(params_frame, text="Help", command=self.show_help_window).grid(row=16, column=0, columnspan=3, pady=10, sticky="ew")
+
+        marked_video_frame = ttk.LabelFrame(left_panel_frame, text="Marked Video Export", padding="10")
+        marked_video_frame.grid(row=4, column=0, padx=5, pady=5, sticky="ew")
+        marked_video_frame.columnconfigure(1, weight=1)
+
+        ttk.Label(marked_video_frame, text="Codec:").grid(row=0, column=0, padx=5, pady=2, sticky="w")
+        ttk.Combobox(marked_video_frame, textvariable=self.marked_video_codec, values=list(MARKED_VIDEO_CODECS),
+                     state="readonly", width=8).grid(row=0, column=1, padx=5, pady=2, sticky="w")
+
+        ttk.Label(marked_video_frame, text="Size (1/N of the original):").grid(row=1, column=0, padx=5, pady=2, sticky="w")
+        ttk.Entry(marked_video_frame, textvariable=self.marked_video_downscale, width=5).grid(row=1, column=1, padx=5, pady=2, sticky="w")
+
+        ttk.Label(marked_video_frame, text="Frame Stride (write every Nth frame):").grid(row=2, column=0, padx=5, pady=2, sticky="w")
+        ttk.Entry(marked_video_frame, textvariable=self.marked_video_frame_stride, width=5).grid(row=2, column=1, padx=5, pady=2, sticky="w")
+
+        ttk.Label(marked_video_frame, text="Folder (empty = next to videos):").grid(row=3, column=0, padx=5, pady=2, sticky="w")
+        ttk.Entry(marked_video_frame, textvariable=self.marked_video_folder, width=20).grid(row=3, column=1, padx=5, pady=2, sticky="ew")
+        ttk.Button(marked_video_frame, text="Browse", command=self.select_marked_video_folder).grid(row=3, column=2, padx=5, pady=2)
+
+        ttk.Label(marked_video_frame, text="Export:").grid(row=4, column=0, padx=5, pady=2, sticky="w")
+        ttk.Combobox(marked_video_frame, textvariable=self.marked_video_export_mode, values=list(self.MARKED_VIDEO_EXPORT_MODES),
+                     state="readonly", width=14).grid(row=4, column=1, padx=5, pady=2, sticky="w")
+
+        ttk.Label(marked_video_frame, text="Bout Padding (seconds):").grid(row=5, column=0, padx=5, pady=2, sticky="w")
+        ttk.Entry(marked_video_frame, textvariable=self.bout_padding_seconds, width=5).grid(row=5, column=1, padx=5, pady=2, sticky="w")
+
+        self.benchmark_export_button = ttk.Button(marked_video_frame, text="Benchmark Export Settings", command=self.start_mark_video_benchmark_thread)
+        self.benchmark_export_button.grid(row=6, column=0, columnspan=3, pady=2, sticky="ew")
 
 
         # --- Middle Panel: File List & Classification ---
@@ -341,6 +507,13 @@ class immobilityAnalyzerGUI:
         self.roi_display_label = ttk.Label(roi_coords_frame, text="0,0,0,0")
         self.roi_display_label.pack(side="left")
 
+        named_rois_frame = ttk.Frame(preview_frame_container)
+        named_rois_frame.pack(pady=2)
+        ttk.Checkbutton(named_rois_frame, text="Add each drawn ROI as a named chamber", variable=self.add_rois_on_draw).pack(side="left", padx=5)
+        ttk.Button(named_rois_frame, text="Clear Named ROIs", command=self.clear_named_rois).pack(side="left", padx=5)
+        self.named_rois_label = ttk.Label(named_rois_frame, text="Named ROIs: none")
+        self.named_rois_label.pack(side="left", padx=5)
+
         ttk.Button(preview_frame_container, text="Load Random Frame", command=self.load_random_frame).pack(pady=5)
 
 
@@ -356,6 +529,12 @@ class immobilityAnalyzerGUI:
         self.run_immobility_csv_button = ttk.Button(button_frame, text="Run immobility Analysis (CSV)", command=self.start_immobility_analysis_thread)
         self.run_immobility_csv_button.pack(side="left", padx=5)
 
+        self.stop_analysis_button = ttk.Button(button_frame, text="Stop Analysis", command=self.stop_analysis, state=tk.DISABLED)
+        self.stop_analysis_button.pack(side="left", padx=5)
+
+        self.recompute_cached_button = ttk.Button(button_frame, text="Recompute from Cached Motion", command=self.recompute_from_cached_motion, state=tk.DISABLED)
+        self.recompute_cached_button.pack(side="left", padx=5)
+
     
         self.export_results_by_categories_button = ttk.Button(button_frame, text="Export Results by Categories", command=self.export_results_by_categories, state=tk.DISABLED)
         self.export_results_by_categories_button.pack(side="left", padx=5)
@@ -418,8 +597,19 @@ class immobilityAnalyzerGUI:
             * **Frame Interval (BG Sub.):** The number of frames between the two frames used for calculating the pixel difference (e.g., 3 means comparing frame N with frame N-3).
             * **immobility Window Size (frames):** The minimum number of *consecutive* "still" frames required for a period to be classified as a immobility bout. Short interruptions in stillness are ignored if they are less than this window size.
             * **Time Bins:** Divides the total video duration into this many equal time bins for summary statistics in the Excel output.
+            * **Bin Length (seconds):** When above 0, the Excel summary uses consecutive bins of this many seconds (starting after the Time Adjustment) instead of the number of Time Bins.
+            * **Protocol epochs:** A configuration file can contain an `"epochs"` list, e.g. `[{"name": "tone1", "start": 120, "end": 140}, ...]`, with times in seconds from the Time Adjustment. When present, the Excel summary has one column per epoch instead of time bins.
             * **Time Adjustment (seconds):** An offset applied to the start of the video for binning calculations (e.g., to exclude an initial acclimation period or pre-stimulus phase from binning).
             * **Generate Binary Area Plot:** Plot the binary area difference so you can visually set threshold of immobility
+            * **Parallel Workers:** Number of videos analysed at the same time in separate processes. With more than one worker the live video preview is disabled and progress is reported per finished video. Results are identical to a one-worker run.
+            * **Split each video across workers:** Instead of analysing several videos at once, each video is cut into one frame range per worker and the ranges are analysed in parallel. Useful for a few very long recordings. The binary area values are identical to a normal run.
+            * **Reuse cached motion:** The binary area values of every analysed video are stored in a `.stillcount_cache` folder next to the videos. They only depend on the video, the ROI, the Video Binarization Threshold and the Frame Interval, so changing any other parameter and re-running skips the video decoding entirely.
+            * **Analysis Stride:** Analyse only every Nth frame (e.g. 2 on a 60 fps camera). The Frame Interval is converted so it still spans the same time, and each analysed value is repeated over the skipped frames, so frame numbers in the CSVs and BORIS exports still match the source video. 1 analyses every frame.
+            * **Named ROIs (multi-chamber rigs):** Tick "Add each drawn ROI as a named chamber" and draw one rectangle per chamber, giving each a name. All named ROIs are analysed in a single pass over each video; every chamber gets its own CSV and its own row in the results Excel, named `<mouse>_<chamber>`. "Clear Named ROIs" goes back to the single drawn ROI. Splitting a video across workers is not used with named ROIs.
+            * **Save per-frame data:** For every subject, also writes a folder `immobility_<mouse>_frames` with the binary area of every frame, the frame-by-frame immobility mask and the analysis parameters (`meta.json`). "Load immobility CSVs & Export Videos" uses these folders when present, which is faster than rebuilding the frames from the CSVs and also allows "Recompute from Cached Motion" afterwards. They are plain NumPy `.npy` files, readable with `numpy.load(..., mmap_mode='r')`.
+            * **Partial results:** `ALL SUBJECTS RESULTS.csv` in the output folder gets one row per subject as soon as it is scored, so you can open it while a long cohort is still running. `ALL SUBJECTS RESULTS.xlsx` is written when the run finishes or is stopped.
+            * **Resuming a run:** Every finished video is checkpointed in the output folder (`stillcount_run.json` and a `.stillcount_checkpoints` folder). If the program or computer stops in the middle of a cohort, run the analysis again with the same output folder, ROI, Video Binarization Threshold, Frame Interval, Analysis Stride and Downscale Factor: finished videos are not decoded again, only re-scored with the current immobility settings.
+            * **Downscale Factor:** Shrinks the ROI by this factor before comparing frames (2 = half width and half height), which is faster on high-resolution cameras. Binary area values are scaled back to full-resolution pixels, so the immobility Event Threshold does not need to change. Use "Test Downscale on Sample Video" to compare speed and immobility scoring against full resolution on the first minute of the selected (or first) video before using it.
         5.  Action Buttons:
             * **Run immobility Analysis (CSV):**
                 * Processes the *selected* videos from the list.
@@ -429,7 +619,12 @@ class immobilityAnalyzerGUI:
                 * Saves `[mouse_name]_immobility.csv` (start/stop times of immobility bouts).
                 * Generates a comprehensive summary Excel file: `ALL immobility RESULTS.xlsx` with total immobility and binned immobility data for all selected videos.
                 * Displays a live progress bar and a reduced-resolution video preview during processing for visual feedback.
+                * With "Write marked videos during analysis" ticked, the marked videos (see "Export Marked Videos") are written in the same pass, so the videos are not decoded a second time. They use the immobility threshold and window size of the run.
                 * **Enables "Export Marked Videos" and "Export Results by Categories" upon successful completion.**
+            * **Recompute from Cached Motion:**
+                * Re-scores the subjects of the last analysis with the current immobility threshold, window size, bins and time adjustment.
+                * Uses the binary area values kept in memory, so no video is decoded. The immobility CSVs and `ALL SUBJECTS RESULTS.xlsx` are rewritten.
+                * Changes to the ROI, Video Binarization Threshold or Frame Interval need a full "Run immobility Analysis (CSV)".
             * **Export Results by Categories:**
                 * Loads the `ALL immobility RESULTS.xlsx` (generated by "Run immobility Analysis (CSV)").
                 * Groups the results by the categories assigned in the "File List & Classification" section.
@@ -443,6 +638,9 @@ class immobilityAnalyzerGUI:
             * Creates `[mouse_name]_MARKED.avi` videos in your output folder.
             * These videos will be at 1/3rd resolution of the original and will have a red circle marking immobility periods.
             * Requires a previous run of "Run immobility Analysis (CSV)" or "Load immobility CSVs & Export Videos" to have populated the internal data cache.
+            * Runs in the background: "Parallel Workers" videos are exported at the same time, and "Stop Analysis" cancels the export (unfinished files are deleted).
+            * **Marked Video Export** settings: the codec (XVID/MJPG/FFV1 in .avi, mp4v in .mp4), the size (1/N of the original, 3 by default), the frame stride (only every Nth frame is written, the video keeps its duration) and the folder (empty = a "Marked videos" folder next to the videos). "Benchmark Export Settings" times every codec on the first 10 seconds of a video and reports encode speed and file size.
+            * **Export:** "Full video" writes the whole session; "Highlight reel" writes one `[video]_BOUTS` file per subject with only the immobility bouts, and "Bout clips" a `[video]_BOUTS` folder with one clip per bout. Each bout gets "Bout Padding" seconds before and after; bouts whose padding overlaps are joined. The video is seeked to every bout, which is much faster for sessions with little immobility.
             * **Exit:** Closes the application.
         """
 
@@ -613,7 +811,25 @@ class immobilityAnalyzerGUI:
         self.frame_interval_bg_sub.set(config.get('frame_interval_bg_sub', self.frame_interval_bg_sub.get()))
         self.window_size_immobility.set(config.get('window_size_immobility', self.window_size_immobility.get()))
         self.bins.set(config.get('bins', self.bins.get()))
+        self.bin_seconds.set(config.get('bin_seconds', self.bin_seconds.get()))
+        self.epochs = config.get('epochs', self.epochs)
         self.time_adjustment.set(config.get('time_adjustment', self.time_adjustment.get()))
+        self.n_workers.set(config.get('n_workers', self.n_workers.get()))
+        self.split_video_segments.set(config.get('split_video_segments', self.split_video_segments.get()))
+        self.use_motion_cache.set(config.get('use_motion_cache', self.use_motion_cache.get()))
+        self.analysis_stride.set(config.get('analysis_stride', self.analysis_stride.get()))
+        self.downscale.set(config.get('downscale', self.downscale.get()))
+        self.save_frame_store.set(config.get('save_frame_store', ANALYSIS_DEFAULTS['save_frame_store']))
+        self.mark_videos_during_analysis.set(config.get('mark_videos_during_analysis', self.mark_videos_during_analysis.get()))
+        self.marked_video_codec.set(config.get('marked_video_codec', self.marked_video_codec.get()))
+        self.marked_video_downscale.set(config.get('marked_video_downscale', self.marked_video_downscale.get()))
+        self.marked_video_frame_stride.set(config.get('marked_video_frame_stride', self.marked_video_frame_stride.get()))
+        self.marked_video_folder.set(config.get('marked_video_folder', self.marked_video_folder.get()))
+        self.marked_video_export_mode.set(config.get('marked_video_export_mode', self.marked_video_export_mode.get()))
+        self.bout_padding_seconds.set(config.get('bout_padding_seconds', self.bout_padding_seconds.get()))
+        self.named_rois = [dict(named_roi) for named_roi in config.get('named_rois', self.named_rois)]
+        if hasattr(self, 'named_rois_label'):
+            self._update_named_rois_label()
     
         self.roi_x1.set(config.get('roi_x1', self.roi_x1.get()))
         self.roi_y1.set(config.get('roi_y1', self.roi_y1.get()))
@@ -707,6 +923,7 @@ class immobilityAnalyzerGUI:
             self.load_random_frame()
             self.export_results_by_categories_button.config(state=tk.DISABLED)
             self.export_video_button.config(state=tk.DISABLED)
+            self.recompute_cached_button.config(state=tk.DISABLED)
             self.analysis_results_cache = {}
             self.selected_file_paths_for_analysis = []
             self._check_enable_export_categories_button()
@@ -735,20 +952,40 @@ class immobilityAnalyzerGUI:
         
         
         
-    def save_config(self):
-        config = {
+    def _current_config(self):
+        """The current settings, in the config file schema (see analysis_params_from_config)."""
+        return {
             'video_threshold': self.video_threshold.get(),
             'immobility_threshold': self.immobility_threshold.get(),
             'frame_interval_bg_sub': self.frame_interval_bg_sub.get(),
             'window_size_immobility': self.window_size_immobility.get(),
             'bins': self.bins.get(),
+            'bin_seconds': self.bin_seconds.get(),
+            'epochs': self.epochs,
             'time_adjustment': self.time_adjustment.get(),
+            'n_workers': self.n_workers.get(),
+            'split_video_segments': self.split_video_segments.get(),
+            'use_motion_cache': self.use_motion_cache.get(),
+            'analysis_stride': self.analysis_stride.get(),
+            'downscale': self.downscale.get(),
+            'save_frame_store': self.save_frame_store.get(),
+            'mark_videos_during_analysis': self.mark_videos_during_analysis.get(),
+            'marked_video_codec': self.marked_video_codec.get(),
+            'marked_video_downscale': self.marked_video_downscale.get(),
+            'marked_video_frame_stride': self.marked_video_frame_stride.get(),
+            'marked_video_folder': self.marked_video_folder.get(),
+            'marked_video_export_mode': self.marked_video_export_mode.get(),
+            'bout_padding_seconds': self.bout_padding_seconds.get(),
+            'named_rois': self.named_rois,
             'roi_x1': self.roi_x1.get(),
             'roi_y1': self.roi_y1.get(),
             'roi_x2': self.roi_x2.get(),
             'roi_y2': self.roi_y2.get(),
             'last_video_folder': self.current_folder_path,
         }
+
+    def save_config(self):
+        config = self._current_config()
         try:
             with open(self.config_file, 'w') as f:
                 json.dump(config, f, indent=4)
@@ -881,6 +1118,12 @@ class immobilityAnalyzerGUI:
                 display_frame[y_min_final:y_max_final, x_min_final:x_max_final] = binary_roi
             else:
                 self.roi_display_label.config(text="Invalid ROI (Zero Area)")
+
+            for named_roi in self.named_rois:
+                roi_gray = temp_gray[named_roi['y1']:named_roi['y2'], named_roi['x1']:named_roi['x2']]
+                if roi_gray.size:
+                    _, binary_roi = cv2.threshold(roi_gray, self.video_threshold.get(), 255, cv2.THRESH_BINARY)
+                    display_frame[named_roi['y1']:named_roi['y2'], named_roi['x1']:named_roi['x2']] = cv2.cvtColor(binary_roi, cv2.COLOR_GRAY2BGR)
     
         # Compute scale and offsets for consistent display
         canvas_w = self.preview_canvas.winfo_width()
@@ -905,6 +1148,12 @@ class immobilityAnalyzerGUI:
         y2_rect = int(y_max_final * scale)
     
         cv2.rectangle(display_frame_resized, (x1_rect, y1_rect), (x2_rect, y2_rect), (0, 255, 0), 2)
+
+        for named_roi in self.named_rois:
+            nx1, ny1 = int(named_roi['x1'] * scale), int(named_roi['y1'] * scale)
+            nx2, ny2 = int(named_roi['x2'] * scale), int(named_roi['y2'] * scale)
+            cv2.rectangle(display_frame_resized, (nx1, ny1), (nx2, ny2), (255, 128, 0), 2)
+            cv2.putText(display_frame_resized, named_roi['name'], (nx1 + 3, ny1 + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 128, 0), 1)
     
         # Convert to PIL image and pad to canvas size
         img = cv2.cvtColor(display_frame_resized, cv2.COLOR_BGR2RGB)
@@ -979,14 +1228,42 @@ class immobilityAnalyzerGUI:
             self.preview_canvas.coords(self.roi_rect_id, x1_rect, y1_rect, x2_rect, y2_rect)
 
         self.update_roi_vars_from_canvas(x1_rect, y1_rect, x2_rect, y2_rect)
-        self.update_preview_display()
 
         self.start_x = None
         self.start_y = None
-    
-    
 
-            
+        if self.add_rois_on_draw.get():
+            self.add_current_roi_as_named()
+        self.update_preview_display()
+
+    def add_current_roi_as_named(self):
+        """Stores the ROI just drawn under a name, so several chambers are analysed in one pass."""
+        x1, y1, x2, y2 = self.get_current_roi_coords()
+        if x2 <= x1 or y2 <= y1:
+            return
+        existing_names = {named_roi['name'] for named_roi in self.named_rois}
+        default_name = f"chamber{len(self.named_rois) + 1}"
+        roi_name = simpledialog.askstring("Name ROI", "Name for this chamber/ROI:", initialvalue=default_name)
+        if not roi_name:
+            return
+        roi_name = roi_name.strip()
+        if roi_name in existing_names:
+            messagebox.showwarning("Duplicate Name", f"An ROI named '{roi_name}' already exists.")
+            return
+        self.named_rois.append({'name': roi_name, 'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2})
+        self._update_named_rois_label()
+
+    def clear_named_rois(self):
+        self.named_rois = []
+        self._update_named_rois_label()
+        self.update_preview_display()
+
+    def _update_named_rois_label(self):
+        if self.named_rois:
+            self.named_rois_label.config(text="Named ROIs: " + ", ".join(named_roi['name'] for named_roi in self.named_rois))
+        else:
+            self.named_rois_label.config(text="Named ROIs: none")
+
     def update_roi_vars_from_canvas(self, x1_canvas, y1_canvas, x2_canvas, y2_canvas):
         if self.preview_frame is None:
             return
@@ -1034,17 +1311,43 @@ class immobilityAnalyzerGUI:
         y2 = self.roi_y2.get()
         return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
 
+    # The three callbacks below run on the analysis thread: they only post to ui_channel,
+    # which _poll_ui_channel applies on the Tk thread.
     def _update_progressbar_per_frame(self, current_frame, total_frames):
+        if self.stop_analysis_event.is_set() or not total_frames:
+            return
+        self.ui_channel.put('progress', (current_frame / total_frames) * 100)
+
+    def _update_progressbar_per_video(self, video_path, completed_videos, total_videos):
         if self.stop_analysis_event.is_set():
             return
-            
-        progress_value = (current_frame / total_frames) * 100
-        self.master.after_idle(lambda: self.progress_bar.config(value=progress_value))
+
+        mouse = Path(video_path).stem.split('-')[0]
+        self.ui_channel.put('progress', (completed_videos / total_videos) * 100)
+        self.ui_channel.put('status', f"Status: Background subtraction done for {mouse} ({completed_videos}/{total_videos})")
 
     def _update_live_video_preview(self, frame):
         if self.stop_analysis_event.is_set():
             return
+        self.ui_channel.put('preview', frame)
+
+    def _live_preview_ready(self):
+        """Lets the core skip building a preview frame while the previous one has not been shown yet."""
+        return not self.ui_channel.has_pending('preview')
 
+    def _poll_ui_channel(self):
+        pending = self.ui_channel.drain()
+        if 'progress' in pending:
+            self.progress_bar.config(value=pending['progress'])
+        if 'status' in pending:
+            self.status_label.config(text=pending['status'])
+        if 'preview' in pending and not self.stop_analysis_event.is_set():
+            self._show_live_video_preview(pending['preview'])
+
+        if self.analysis_thread is not None and self.analysis_thread.is_alive():
+            self.master.after(UI_POLL_INTERVAL_MS, self._poll_ui_channel)
+
+    def _show_live_video_preview(self, frame):
         display_width = self.preview_canvas.winfo_width()
         display_height = self.preview_canvas.winfo_height()
         
@@ -1063,8 +1366,7 @@ class immobilityAnalyzerGUI:
         img = Image.fromarray(img)
         
         self.photo = ImageTk.PhotoImage(image=img)
-        
-        self.master.after_idle(lambda: self.preview_canvas.create_image(0, 0, image=self.photo, anchor="nw"))
+        self.preview_canvas.create_image(0, 0, image=self.photo, anchor="nw")
 
     
 
@@ -1077,6 +1379,9 @@ class immobilityAnalyzerGUI:
             print(f"No binary difference data to plot for {mouse_name}.")
             return
     
+        # Imported here so opening the GUI (and every analysis worker) does not pay for matplotlib
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(10, 6))
         plt.plot(binary_area_series.index, binary_area_series.values,
                  label='Binary Diff Pixel Count', color='blue')
@@ -1113,14 +1418,17 @@ class immobilityAnalyzerGUI:
         self.export_video_button.config(state=tk.DISABLED)
         
         self.run_immobility_csv_button.config(state=tk.DISABLED)
+        self.recompute_cached_button.config(state=tk.DISABLED)
         self.load_csv_export_video_button.config(state=tk.DISABLED)
+        self.stop_analysis_button.config(state=tk.NORMAL)
         self.stop_analysis_event.clear()
 
+        self.ui_channel.drain()
         self.analysis_thread = threading.Thread(target=self._run_immobility_analysis_csv_threaded)
         self.analysis_thread.start()
+        self.master.after(UI_POLL_INTERVAL_MS, self._poll_ui_channel)
 
     def _run_immobility_analysis_csv_threaded(self):
-        dir_path = self.current_folder_path
         output_folder = self.output_dir_var.get()
 
         os.makedirs(output_folder, exist_ok=True)
@@ -1131,99 +1439,200 @@ class immobilityAnalyzerGUI:
             self.master.after_idle(self._analysis_finished_callback)
             return
 
-
-        video_threshold = float(self.video_threshold.get())
-        immobility_threshold = float(self.immobility_threshold.get())
-        window_size_immobility = int(self.window_size_immobility.get())
-        frame_interval_bg_sub = int(self.frame_interval_bg_sub.get())
-        bins = int(self.bins.get())
-        time_adjustment = int(self.time_adjustment.get())
-        
-        roi_x, roi_y, roi_x2_val, roi_y2_val = self.get_current_roi_coords()
-        roi_width = abs(roi_x2_val - roi_x)
-        roi_height = abs(roi_y2_val - roi_y)
-
-        if roi_width <= 0 or roi_height <= 0:
+        try:
+            params = analysis_params_from_config(self._current_config())
+        except ValueError:
             self.master.after_idle(lambda: messagebox.showerror("ROI Error", "Invalid ROI dimensions (width or height is zero). Please draw a valid ROI."))
             self.master.after_idle(self._analysis_finished_callback)
             return
 
- 
-
         self.master.after_idle(lambda: self.status_label.config(text="Status: Starting immobility analysis (CSV generation)..."))
         self.master.after_idle(lambda: self.progress_bar.grid())
         self.master.after_idle(lambda: self.progress_bar.config(value=0, maximum=100))
 
         self.analysis_results_cache = {}
-        all_results_excel_combined = pd.DataFrame()
-        total_videos = len(self.selected_file_paths_for_analysis)
-        processed_count = 0
+        plot_binary_area = self.plot_binary_area_var.get()
 
-        for video_path in self.selected_file_paths_for_analysis:
-            if self.stop_analysis_event.is_set():
-                break
+        def video_started(video_path, index, total):
+            self.ui_channel.put('status', f"Status: Processing ({index}/{total}) {video_subject(video_path)}...")
 
-            processed_count += 1
-            mouse = Path(video_path).stem.split('-')[0]
-            self.master.after_idle(lambda m=mouse, pc=processed_count, tv=total_videos: self.status_label.config(text=f"Status: Processing ({pc}/{tv}) {m}..."))
-            
-            framerate, binary_area_series = run_background_subtraction_for_analysis(
-                video_path, roi_x, roi_y, roi_width, roi_height, video_threshold, frame_interval_bg_sub,
-                progress_callback=self._update_progressbar_per_frame,
-                frame_display_callback=self._update_live_video_preview,
-                stop_event=self.stop_analysis_event
-            )
+        def subject_done(subject, result):
+            self._cache_subject_result(subject, result)
+            if plot_binary_area:
+                self.master.after_idle(
+                    lambda m=subject, bas=result['binary_area_series'], ft=params['immobility_threshold'], op=output_folder:
+                        self.plot_binary_diff(m, bas, ft, op)
+                )
 
+        summary_table, _, _ = run_cohort(
+            self.selected_file_paths_for_analysis, params, output_folder, stop_event=self.stop_analysis_event,
+            frame_progress_callback=lambda video_path, current_frame, total_frames: self._update_progressbar_per_frame(current_frame, total_frames),
+            segment_progress_callback=lambda video_path, completed, total: self._update_progressbar_per_frame(completed, total),
+            video_start_callback=video_started,
+            video_analysed_callback=self._update_progressbar_per_video,
+            subject_done_callback=subject_done,
+            subject_failed_callback=lambda video_path, subject, message: self.master.after_idle(
+                lambda m=subject: messagebox.showwarning("Warning", f"Could not get binary area data for {m}. Skipping.")),
+            frame_display_callback=self._update_live_video_preview,
+            preview_ready=self._live_preview_ready
+        )
+        # Selection order for the export, whatever order the videos finished in
+        self.analysis_results_cache = {
+            subject: self.analysis_results_cache[subject] for subject in summary_table.subjects
+            if subject in self.analysis_results_cache
+        }
+
+        if len(summary_table):
+            summary_table.write_excel()
             if self.stop_analysis_event.is_set():
-                break
+                self.master.after_idle(lambda: messagebox.showinfo("Analysis Stopped", "Analysis stopped. ALL SUBJECTS RESULTS.xlsx contains the subjects completed before stopping."))
+            else:
+                self.master.after_idle(lambda: messagebox.showinfo("Analysis Complete", f"Immobility analysis CSVs and ALL immobility RESULTS.xlsx generated successfully."))
+        else:
+            self.master.after_idle(lambda: messagebox.showwarning("Analysis Result", "No immobility data generated for any videos."))
 
-            if binary_area_series.empty:
-                self.master.after_idle(lambda m=mouse: messagebox.showwarning("Warning", f"Could not get binary area data for {m}. Skipping."))
-                continue
+        self.master.after_idle(self._analysis_finished_callback)
 
+    def _cache_subject_result(self, mouse, result):
+        """Keeps a scored subject (as returned by score_cohort_subject) for export and re-scoring."""
+        self.analysis_results_cache.setdefault(mouse, {}).update({
+            'persistent_immobility': result['persistent_immobility'],
+            'frame_events': result['frame_events'],
+            'seconds_immobile': result['seconds_immobility'],
+            'binary_area_series': result['binary_area_series'], # Store binary_area_series here
+            'framerate': result['framerate'],
+            'motion_params': result['motion_params'],
+            'video_path': result['video_path'],
+            'roi_name': result['roi_name']
+        })
+
+    def _resolve_subject_video(self, mouse, parameters=None):
+        """
+        Finds the original video of a loaded subject: the video_path / roi_name saved in its frame store's
+        meta.json, otherwise self.video_files, stripping a "_<roi>" suffix for named-ROI subjects.
+        Returns (video_path, roi_name); video_path is None when no video matches.
+        """
+        parameters = parameters or {}
+        video_path = parameters.get('video_path')
+        if video_path and os.path.exists(video_path):
+            return video_path, parameters.get('roi_name')
+        if mouse in self.video_files:
+            return self.video_files[mouse], None
+        # Named-ROI subjects are "<mouse>_<roi>"; the mouse part can itself contain underscores
+        name_parts = mouse.split('_')
+        for split_idx in range(len(name_parts) - 1, 0, -1):
+            video_mouse = '_'.join(name_parts[:split_idx])
+            if video_mouse in self.video_files:
+                return self.video_files[video_mouse], '_'.join(name_parts[split_idx:])
+        return None, None
+
+    def recompute_from_cached_motion(self):
+        """Re-scores the last analysed subjects with the current parameters without decoding any video."""
+        output_folder = self.output_dir_var.get()
+        if not output_folder or not os.path.isdir(output_folder):
+            messagebox.showwarning("Input Error", "Please select a valid output folder!")
+            return
 
-            persistent_immobility, frame_events, seconds_immobility = detect_immobility(
-                binary_area_series, immobility_threshold, window_size_immobility, framerate
-            )
-            
-            self.analysis_results_cache[mouse] = {
-                'persistent_immobility': persistent_immobility,
-                'frame_events': frame_events,
-                'seconds_immobile': seconds_immobility,
-                'binary_area_series': binary_area_series # Store binary_area_series here
-            }
+        if self.analysis_thread and self.analysis_thread.is_alive():
+            messagebox.showwarning("Analysis Running", "Please wait for the running analysis to finish.")
+            return
 
-            create_csv_immobility(persistent_immobility, mouse, framerate, output_folder)
+        cached_subjects = [
+            (mouse, data) for mouse, data in self.analysis_results_cache.items()
+            if data.get('binary_area_series') is not None and data.get('framerate') is not None
+        ]
+        if not cached_subjects:
+            messagebox.showwarning("No Data", "No cached motion data found. Please run 'Run immobility Analysis (CSV)' first.")
+            return
 
-            immobility_by_bins_df = calculate_immobility_by_bin_core(
-                persistent_immobility, bins, framerate, time_adjustment
+        self.save_config()
+        try:
+            params = analysis_params_from_config(self._current_config())
+        except ValueError as e:
+            messagebox.showerror("ROI Error", str(e))
+            return
+
+        self.status_label.config(text=f"Status: Recomputing {len(cached_subjects)} subjects from cached motion...")
+        self.master.update_idletasks()
+
+        start_time = time.perf_counter()
+        summary_table = SummaryTable(output_folder)
+        for mouse, data in cached_subjects:
+            result = score_cohort_subject(
+                mouse, data['framerate'], data['binary_area_series'], params, output_folder, data.get('motion_params'),
+                video_path=data.get('video_path'), roi_name=data.get('roi_name')
             )
-            total_immobility_df = pd.DataFrame({'total_immobility': [seconds_immobility]})
-            current_mouse_results = pd.concat([total_immobility_df, immobility_by_bins_df], axis=1)
-            current_mouse_results.index = [mouse]
-            all_results_excel_combined = pd.concat([all_results_excel_combined, current_mouse_results], axis=0, sort=False)
+            self._cache_subject_result(mouse, result)
+            summary_table.add(mouse, result['summary'])
+
+        summary_table.write_excel()
+        elapsed = time.perf_counter() - start_time
+        self.status_label.config(text=f"Status: Recomputed {len(cached_subjects)} subjects from cached motion in {elapsed:.2f} s")
+        print(f"Recomputed {len(cached_subjects)} subjects from cached motion in {elapsed:.2f} s")
+
+    def start_downscale_test_thread(self):
+        """Compares downscaled and full-resolution analysis on the first minute of one video."""
+        video_paths = list(self.selected_file_paths_for_analysis) or list(self.video_files.values())
+        if not video_paths:
+            messagebox.showwarning("Input Error", "Please select a video folder first!")
+            return
 
-            if self.plot_binary_area_var.get():
-                self.master.after_idle(
-                    lambda m=mouse, bas=binary_area_series, ft=immobility_threshold, op=output_folder:
-                        self.plot_binary_diff(m, bas, ft, op)
-                )
+        downscale = max(1, int(self.downscale.get()))
+        if downscale == 1:
+            messagebox.showinfo("Downscale Test", "Set the Downscale Factor above 1 to compare it against full resolution.")
+            return
 
-            self.master.after_idle(lambda pc=processed_count, tv=total_videos: self.progress_bar.config(value=(pc / tv) * 100))
+        roi_x, roi_y, roi_x2_val, roi_y2_val = self.get_current_roi_coords()
+        roi_width = abs(roi_x2_val - roi_x)
+        roi_height = abs(roi_y2_val - roi_y)
+        if roi_width <= 0 or roi_height <= 0:
+            messagebox.showerror("ROI Error", "Invalid ROI dimensions (width or height is zero). Please draw a valid ROI.")
+            return
 
-        if not all_results_excel_combined.empty:
-            final_excel_path = os.path.join(output_folder, "ALL SUBJECTS RESULTS.xlsx")
-            all_results_excel_combined.to_excel(final_excel_path)
-            self.master.after_idle(lambda: messagebox.showinfo("Analysis Complete", f"Immobility analysis CSVs and ALL immobility RESULTS.xlsx generated successfully."))
-        else:
-            self.master.after_idle(lambda: messagebox.showwarning("Analysis Result", "No immobility data generated for any videos."))
+        video_path = video_paths[0]
+        params = (
+            video_path, roi_x, roi_y, roi_width, roi_height,
+            float(self.video_threshold.get()), int(self.frame_interval_bg_sub.get()),
+            float(self.immobility_threshold.get()), int(self.window_size_immobility.get()), downscale
+        )
+        self.test_downscale_button.config(state=tk.DISABLED)
+        self.status_label.config(text=f"Status: Testing downscale x{downscale} on {os.path.basename(video_path)}...")
+        threading.Thread(target=self._run_downscale_test_threaded, args=params, daemon=True).start()
 
-        self.master.after_idle(self._analysis_finished_callback)
+    def _run_downscale_test_threaded(self, video_path, *params):
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        cap.release()
+        comparison = compare_downscale_agreement(video_path, *params, max_frames=int(round(fps * 60)))
+        downscale = params[-1]
+        report = (
+            f"Sample: first minute of {os.path.basename(video_path)}\n\n"
+            f"Full resolution: {comparison['full_resolution_seconds']:.2f} s\n"
+            f"Downscale x{downscale}: {comparison['downscaled_seconds']:.2f} s ({comparison['speedup']:.2f}x faster)\n\n"
+            f"Frames with the same immobility state: {comparison['agreement'] * 100:.2f}%\n"
+            f"Immobility: {comparison['immobility_seconds_full']:.2f} s (full) vs "
+            f"{comparison['immobility_seconds_downscaled']:.2f} s (downscaled)"
+        )
+        print(report)
+
+        def show_report():
+            self.test_downscale_button.config(state=tk.NORMAL)
+            self.status_label.config(text="Status: Downscale test finished.")
+            messagebox.showinfo("Downscale Test", report)
+        self.master.after_idle(show_report)
+
+    def stop_analysis(self):
+        """Asks the running analysis to stop; the current video is abandoned within a few frames."""
+        if self.analysis_thread and self.analysis_thread.is_alive():
+            self.stop_analysis_event.set()
+            self.stop_analysis_button.config(state=tk.DISABLED)
+            self.status_label.config(text="Status: Stopping analysis...")
 
     def _analysis_finished_callback(self):
         self.progress_bar.grid_remove()
         self.progress_bar.config(value=0)
         
+        self.stop_analysis_button.config(state=tk.DISABLED)
         self.run_immobility_csv_button.config(state=tk.NORMAL)
         self.load_csv_export_video_button.config(state=tk.NORMAL)
 
@@ -1231,11 +1640,18 @@ class immobilityAnalyzerGUI:
             self.status_label.config(text="Status: No immobility data generated for any videos.")
             self.export_results_by_categories_button.config(state=tk.DISABLED)
             self.export_video_button.config(state=tk.DISABLED)
+            self.recompute_cached_button.config(state=tk.DISABLED)
             messagebox.showwarning("Analysis Result", "No immobility data generated for any videos.")
+        elif self.stop_analysis_event.is_set():
+            self.status_label.config(text=f"Status: Analysis stopped. Results saved for {len(self.analysis_results_cache)} completed subjects.")
+            self.export_results_by_categories_button.config(state=tk.NORMAL)
+            self.export_video_button.config(state=tk.NORMAL)
+            self.recompute_cached_button.config(state=tk.NORMAL)
         else:
             self.status_label.config(text="Status: immobility analysis (CSV & Excel) Complete!")
             self.export_results_by_categories_button.config(state=tk.NORMAL)
             self.export_video_button.config(state=tk.NORMAL)
+            self.recompute_cached_button.config(state=tk.NORMAL)
         print("immobility analysis (CSV & Excel) complete.")
 
     def _check_enable_export_categories_button(self):
@@ -1319,6 +1735,76 @@ class immobilityAnalyzerGUI:
             messagebox.showerror("Export Error", f"Failed to export results by categories: {e}")
 
 
+    def _marked_video_options(self):
+        """Codec, size and frame stride of the marked videos, as create_immobility_mark_video arguments."""
+        return {
+            'codec': self.marked_video_codec.get(),
+            'downscale': max(1, int(self.marked_video_downscale.get())),
+            'frame_stride': max(1, int(self.marked_video_frame_stride.get())),
+        }
+
+    def _marked_video_path(self, video_path, roi_name=None):
+        return marked_video_path(video_path, roi_name, self.marked_video_folder.get() or None,
+                                 self.marked_video_codec.get())
+
+    def _bout_clip_options(self):
+        """create_immobility_bout_clips arguments for the selected export mode, or None for full videos."""
+        highlight_reel = self.MARKED_VIDEO_EXPORT_MODES.get(self.marked_video_export_mode.get())
+        if highlight_reel is None:
+            return None
+        return {'padding_seconds': max(0.0, float(self.bout_padding_seconds.get())), 'highlight_reel': highlight_reel}
+
+    def _marked_export_path(self, video_path, roi_name=None):
+        """Full marked video, highlight reel (<video>_BOUTS) or clip folder, depending on the export mode."""
+        bout_clip_options = self._bout_clip_options()
+        if bout_clip_options is None:
+            return self._marked_video_path(video_path, roi_name)
+        reel_path = marked_video_path(video_path, roi_name, self.marked_video_folder.get() or None,
+                                      self.marked_video_codec.get(), suffix="_BOUTS")
+        return reel_path if bout_clip_options['highlight_reel'] else reel_path.with_suffix("")
+
+    def select_marked_video_folder(self):
+        folder_selected = filedialog.askdirectory(title="Select folder for the marked videos")
+        if folder_selected:
+            self.marked_video_folder.set(folder_selected)
+
+    def start_mark_video_benchmark_thread(self):
+        """Times every codec with the current size and frame stride on the first 10 seconds of one video."""
+        video_paths = list(self.selected_file_paths_for_analysis) or list(self.video_files.values())
+        if not video_paths:
+            messagebox.showwarning("Input Error", "Please select a video folder first!")
+            return
+
+        options = self._marked_video_options()
+        settings = [dict(options, codec=codec) for codec in MARKED_VIDEO_CODECS]
+        self.benchmark_export_button.config(state=tk.DISABLED)
+        self.status_label.config(text=f"Status: Benchmarking marked video settings on {os.path.basename(video_paths[0])}...")
+        threading.Thread(target=self._run_mark_video_benchmark_threaded, args=(video_paths[0], settings), daemon=True).start()
+
+    def _run_mark_video_benchmark_threaded(self, video_path, settings):
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        cap.release()
+        results = benchmark_mark_video_settings(video_path, settings, max_frames=int(round(fps * 10)))
+        lines = [f"Sample: first 10 seconds of {os.path.basename(video_path)}\n"]
+        for result in results:
+            setting = f"{result['codec']}, 1/{result['downscale']} size, every {result['frame_stride']} frame(s)"
+            if not result['ok']:
+                lines.append(f"{setting}: not available in this OpenCV build")
+                continue
+            lines.append(
+                f"{setting}: encode {result['encode_fps']:.0f} fps, overall {result['total_fps']:.1f} fps, "
+                f"{result['mb_per_hour']:.0f} MB per hour of video"
+            )
+        report = "\n".join(lines)
+        print(report)
+
+        def show_report():
+            self.benchmark_export_button.config(state=tk.NORMAL)
+            self.status_label.config(text="Status: Marked video benchmark finished.")
+            messagebox.showinfo("Marked Video Benchmark", report)
+        self.master.after_idle(show_report)
+
     def export_marked_videos(self):
         output_folder = self.output_dir_var.get()
         if not output_folder or not os.path.isdir(output_folder):
@@ -1331,18 +1817,14 @@ class immobilityAnalyzerGUI:
                 "No immobility calculation data found. Please run 'Run immobility Analysis (CSV)' first or 'Load immobility CSVs & Export Videos'."
             )
             return
+        if self.analysis_thread is not None and self.analysis_thread.is_alive():
+            messagebox.showwarning("Busy", "Please wait until the running analysis or export has finished.")
+            return
     
-        total_videos_to_export = len(self.analysis_results_cache)
-        exported_count = 0
-    
+        export_jobs = []
+        export_subjects = []
         for mouse, data in self.analysis_results_cache.items():
-            exported_count += 1
-            self.status_label.config(
-                text=f"Status: Exporting video ({exported_count}/{total_videos_to_export}) for {mouse}..."
-            )
-            self.master.update_idletasks()
-    
-            video_path = self.video_files.get(mouse)
+            video_path = data.get('video_path') or self.video_files.get(mouse)
             if not video_path:
                 messagebox.showwarning(
                     "Video Not Found",
@@ -1358,32 +1840,68 @@ class immobilityAnalyzerGUI:
                 )
                 continue
 
-            input_folder = Path(video_path).parent
+            # "Marked videos" folder next to the source video
+            output_file_path = self._marked_export_path(video_path, data.get('roi_name'))
+            export_jobs.append((video_path, output_file_path, frame_events))
+            export_subjects.append(mouse)
 
-            # Create a "Marked videos" folder inside that folder
-            output_folder_marked = input_folder / "Marked videos"
-            os.makedirs(output_folder_marked, exist_ok=True)
-            
-            # Build the output video path
-            output_video_name = Path(video_path).stem + "_MARKED.avi"
-            output_file_path = output_folder_marked / output_video_name
-
-    
-            # Define a local callback that prints every 100 frames
-            def local_frame_progress_callback(current_frame, total_frames):
-                if current_frame % 1000 == 0 or current_frame == total_frames - 1:
-                    print(f"[{mouse}] Processing frame {current_frame+1}/{total_frames}")
-    
-            # Call your existing function but pass the local callback
-            create_immobility_mark_video(
-                video_path,
-                output_file_path,
-                frame_events,
-                frame_progress_callback=local_frame_progress_callback  # if your function accepts it
-            )
-    
-        self.status_label.config(text="Status: Video Export Complete!")
-        messagebox.showinfo("Video Export Complete", "All marked videos exported successfully.")
+        if not export_jobs:
+            return
+
+        # Same worker / stop / progress plumbing as the analysis, so the window stays responsive
+        n_videos = max(1, int(self.n_workers.get()))
+        self._recompute_state_before_export = str(self.recompute_cached_button['state'])
+        self.run_immobility_csv_button.config(state=tk.DISABLED)
+        self.recompute_cached_button.config(state=tk.DISABLED)
+        self.load_csv_export_video_button.config(state=tk.DISABLED)
+        self.export_video_button.config(state=tk.DISABLED)
+        self.stop_analysis_button.config(state=tk.NORMAL)
+        self.stop_analysis_event.clear()
+        self.progress_bar.grid()
+        self.progress_bar.config(value=0, maximum=100)
+        self.status_label.config(
+            text=f"Status: Exporting {len(export_jobs)} marked videos ({min(n_videos, len(export_jobs))} at once)..."
+        )
+
+        self.ui_channel.drain()
+        self.analysis_thread = threading.Thread(target=self._export_marked_videos_threaded,
+                                                args=(export_jobs, export_subjects, n_videos))
+        self.analysis_thread.start()
+        self.master.after(UI_POLL_INTERVAL_MS, self._poll_ui_channel)
+
+    def _export_marked_videos_threaded(self, export_jobs, export_subjects, n_videos):
+        def export_progress(frames_done, total_frames, videos_done, total_videos):
+            if self.stop_analysis_event.is_set():
+                return
+            if total_frames:
+                self.ui_channel.put('progress', (frames_done / total_frames) * 100)
+            self.ui_channel.put('status', f"Status: Exporting marked videos ({videos_done}/{total_videos} done)...")
+
+        results = create_immobility_mark_videos(export_jobs, n_videos, progress_callback=export_progress,
+                                                stop_event=self.stop_analysis_event,
+                                                mark_video_options=self._marked_video_options(),
+                                                bout_clips=self._bout_clip_options())
+        failed_subjects = [mouse for mouse, written in zip(export_subjects, results) if not written]
+        self.master.after_idle(lambda: self._export_finished_callback(len(export_jobs), failed_subjects))
+
+    def _export_finished_callback(self, total_videos, failed_subjects):
+        self.progress_bar.grid_remove()
+        self.progress_bar.config(value=0)
+        self.stop_analysis_button.config(state=tk.DISABLED)
+        self.run_immobility_csv_button.config(state=tk.NORMAL)
+        self.load_csv_export_video_button.config(state=tk.NORMAL)
+        self.export_video_button.config(state=tk.NORMAL)
+        self.recompute_cached_button.config(state=self._recompute_state_before_export)
+
+        if self.stop_analysis_event.is_set():
+            exported = total_videos - len(failed_subjects)
+            self.status_label.config(text=f"Status: Video export stopped ({exported}/{total_videos} videos written).")
+        elif failed_subjects:
+            self.status_label.config(text="Status: Video export finished with errors.")
+            messagebox.showwarning("Video Export", "Could not export marked videos for: " + ", ".join(failed_subjects))
+        else:
+            self.status_label.config(text="Status: Video Export Complete!")
+            messagebox.showinfo("Video Export Complete", "All marked videos exported successfully.")
         print("Video export complete.")
 
     
@@ -1463,6 +1981,7 @@ class immobilityAnalyzerGUI:
         self.master.update_idletasks()
     
         self.analysis_results_cache = {}
+        self.recompute_cached_button.config(state=tk.DISABLED)
         csv_files_found = list(Path(folder_selected).glob("immobility_*.csv"))
         self.video_files, self.framerate = take_all_files(folder_selected)
     
@@ -1481,11 +2000,34 @@ class immobilityAnalyzerGUI:
         processed_csv_count = 0
         total_csvs = len(csv_files_found)
         errors_found = False
+
+        # Per-frame stores hold the exact masks (and binary areas): no CSV parsing needed for those subjects
+        for mouse_name, store_path in find_frame_stores(folder_selected).items():
+            frame_store = load_frame_store(store_path)
+            if frame_store is None:
+                continue
+            persistent_immobility_arr = frame_store['persistent_immobility']
+            frame_events = np.flatnonzero(persistent_immobility_arr).tolist()
+            framerate = frame_store['framerate']
+            video_path, roi_name = self._resolve_subject_video(mouse_name, frame_store['meta'].get('parameters'))
+            self.analysis_results_cache[mouse_name] = {
+                'frame_events': frame_events,
+                'persistent_immobility': persistent_immobility_arr,
+                'seconds_immobility': len(frame_events) / framerate if framerate else np.nan,
+                # Copied out of the memory map so re-scoring can overwrite the store's files
+                'binary_area_series': pd.Series(np.array(frame_store['binary_area'], dtype=np.int64)),
+                'framerate': framerate,
+                'motion_params': frame_store['meta'].get('parameters'),
+                'video_path': video_path,
+                'roi_name': roi_name
+            }
     
         # --- Process CSVs ---
         for csv_path in csv_files_found:
             processed_csv_count += 1
             mouse_name = csv_path.stem.replace('immobility_', '')
+            if mouse_name in self.analysis_results_cache:
+                continue
             self.status_label.config(text=f"Status: Parsing CSV ({processed_csv_count}/{total_csvs}) for {mouse_name}...")
             self.progress_bar.config(value=(processed_csv_count / total_csvs) * 50)  # use 0-50% for CSV parsing
             self.master.update_idletasks()
@@ -1502,42 +2044,51 @@ class immobilityAnalyzerGUI:
                         continue
                     
                     immobility_events_df['Image index'] = immobility_events_df['Image index'].astype(int)
-                    temp_frame_events_set = set()
-                    immobility_events_df_sorted = immobility_events_df.sort_values(by=['Image index', 'Behavior type'], ascending=[True, True])
-                    active_bouts = {}
-                    
-                    for _, row in immobility_events_df_sorted.iterrows():
-                        img_idx = row['Image index']
-                        event_type = row['Behavior type']
+                    bout_starts = np.sort(immobility_events_df.loc[immobility_events_df['Behavior type'] == 'START', 'Image index'].to_numpy())
+                    bout_stops = np.sort(immobility_events_df.loc[immobility_events_df['Behavior type'] == 'STOP', 'Image index'].to_numpy())
+
+                    if len(bout_starts) == len(bout_stops) and np.all(bout_starts <= bout_stops):
+                        # Well-formed START/STOP pairs (as written by create_csv_immobility)
+                        frame_events = np.flatnonzero(bouts_to_mask(bout_starts, bout_stops)).tolist()
+                    else:
+                        temp_frame_events_set = set()
+                        immobility_events_df_sorted = immobility_events_df.sort_values(by=['Image index', 'Behavior type'], ascending=[True, True])
+                        active_bouts = {}
                         
-                        if event_type == 'START':
-                            active_bouts[img_idx] = True
-                        elif event_type == 'STOP':
-                            matching_start = None
-                            for start_i in sorted(active_bouts.keys()):
-                                if active_bouts[start_i]:
-                                    matching_start = start_i
-                                    break
-                            if matching_start is not None:
-                                for frame_num in range(matching_start, img_idx + 1):
-                                    temp_frame_events_set.add(frame_num)
-                                del active_bouts[matching_start]
-                            else:
-                                print(f"Warning: STOP event at {img_idx} without matching START in {csv_path}. Skipping.")
-                                errors_found = True
-                    
-                    frame_events = sorted(list(temp_frame_events_set))
+                        for _, row in immobility_events_df_sorted.iterrows():
+                            img_idx = row['Image index']
+                            event_type = row['Behavior type']
+                            
+                            if event_type == 'START':
+                                active_bouts[img_idx] = True
+                            elif event_type == 'STOP':
+                                matching_start = None
+                                for start_i in sorted(active_bouts.keys()):
+                                    if active_bouts[start_i]:
+                                        matching_start = start_i
+                                        break
+                                if matching_start is not None:
+                                    for frame_num in range(matching_start, img_idx + 1):
+                                        temp_frame_events_set.add(frame_num)
+                                    del active_bouts[matching_start]
+                                else:
+                                    print(f"Warning: STOP event at {img_idx} without matching START in {csv_path}. Skipping.")
+                                    errors_found = True
+                        
+                        frame_events = sorted(list(temp_frame_events_set))
     
                     if frame_events:
                         max_frame = max(frame_events)
                         persistent_immobility_arr = np.zeros(max_frame + 1, dtype=int)
-                        for f_idx in frame_events:
-                            persistent_immobility_arr[f_idx] = 1
+                        persistent_immobility_arr[frame_events] = 1
+                        video_path, roi_name = self._resolve_subject_video(mouse_name)
                         
                         self.analysis_results_cache[mouse_name] = {
                             'frame_events': frame_events,
                             'persistent_immobility': persistent_immobility_arr,
-                            'seconds_immobility': len(frame_events) / self.framerate
+                            'seconds_immobility': len(frame_events) / self.framerate,
+                            'video_path': video_path,
+                            'roi_name': roi_name
                         }
                     else:
                         print(f"No valid immobility frames reconstructed from {csv_path}. Skipping.")
@@ -1556,6 +2107,8 @@ class immobilityAnalyzerGUI:
             messagebox.showinfo("CSV Load Complete", "immobility CSVs loaded successfully. You can now 'Export Marked Videos'.")
             self.export_video_button.config(state=tk.NORMAL)
             self.export_results_by_categories_button.config(state=tk.DISABLED)
+            if any(data.get('binary_area_series') is not None for data in self.analysis_results_cache.values()):
+                self.recompute_cached_button.config(state=tk.NORMAL)
         else:
             messagebox.showwarning("No Data Loaded", "No valid immobility data could be loaded from CSVs.")
             self.export_video_button.config(state=tk.DISABLED)